@@ -0,0 +1,115 @@
+# Running aggregates behind the Key Metrics row and the charts.
+# Totals, per-category histograms (outcome, violation, and the demographics
+# breakdown) and the top outcomes are kept as counters that new stops are
+# folded into, so a sync costs O(batch) and serving the widgets does not
+# touch the dataset at all. A synced batch adds its value counts to the
+# counters; rows it replaces (xmin mode) are subtracted again.
+
+import threading
+from collections import Counter
+
+import pandas as pd
+
+DEMOGRAPHIC_KEYS = ['driver_gender', 'year', 'country_name', 'stop_outcome']
+TOP_K = 5
+
+
+def _fold(counter, counts, sign=1):
+    for key, count in counts.items():
+        counter[key] += sign * int(count)
+        if counter[key] <= 0:
+            del counter[key]
+
+
+# Values with the highest counts, largest first; ties go to the smallest
+# value like idxmax over a sorted groupby
+def _top(counter, k):
+    return sorted(counter.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+class AggregateStore:
+    def __init__(self, top_k=TOP_K):
+        self.top_k = top_k
+        self.total_stops = 0
+        self.total_arrests = 0
+        self.outcomes = Counter()      # stop_outcome -> stops
+        self.violations = Counter()    # violation -> stops
+        self.demographics = Counter()  # (gender, year, country, outcome) -> stops
+        self._frames = {}              # served frames, dropped on every update
+        self._lock = threading.Lock()
+
+    def build(self, data):
+        with self._lock:
+            self.total_stops = self.total_arrests = 0
+            self.outcomes, self.violations, self.demographics = Counter(), Counter(), Counter()
+        self.update(data)
+
+    # Fold a batch of new stops in (and take out replaced ones)
+    def update(self, delta, removed=None):
+        batches = [(frame, sign) for frame, sign in ((delta, 1), (removed, -1)) if frame is not None and len(frame)]
+        counts = [(self._count(frame), sign) for frame, sign in batches]
+        with self._lock:
+            for (stops, arrests, outcomes, violations, demographics), sign in counts:
+                self.total_stops += sign * stops
+                self.total_arrests += sign * arrests
+                _fold(self.outcomes, outcomes, sign)
+                _fold(self.violations, violations, sign)
+                _fold(self.demographics, demographics, sign)
+            self._frames = {}
+
+    @staticmethod
+    def _count(frame):
+        year = pd.to_datetime(frame['stop_date']).dt.year.rename('year')
+        demographics = frame.groupby(
+            [frame['driver_gender'], year, frame['country_name'], frame['stop_outcome']], observed=True,
+        ).size()
+        return (
+            len(frame),
+            int(frame['is_arrested'].sum()),
+            frame['stop_outcome'].value_counts(),
+            frame['violation'].value_counts(),
+            demographics,
+        )
+
+    # Most common outcomes as [(outcome, stops), ...]
+    def top_outcomes(self):
+        with self._lock:
+            return _top(self.outcomes, self.top_k)
+
+    # Numbers for the Key Metrics row (same keys as rollups.key_metrics)
+    def metrics(self):
+        with self._lock:
+            top = _top(self.outcomes, 1)
+            return {
+                'total_stops': self.total_stops,
+                'total_arrests': self.total_arrests,
+                'unique_outcomes': len(self.outcomes),
+                'unique_violations': len(self.violations),
+                'most_common_outcome': top[0][0] if top else None,
+            }
+
+    # Stops per violation for the pie chart
+    def violation_counts(self):
+        return self._frame('violations', self._violation_frame)
+
+    # Stops per gender, year, country and outcome for the demographics chart
+    def demographic_counts(self):
+        return self._frame('demographics', self._demographic_frame)
+
+    # Frames are built once per update and shared; callers must not modify them
+    def _frame(self, name, build):
+        with self._lock:
+            frame = self._frames.get(name)
+            if frame is None:
+                frame = self._frames[name] = build()
+            return frame
+
+    def _violation_frame(self):
+        counts = _top(self.violations, len(self.violations))
+        return pd.DataFrame(counts, columns=['Violation', 'Count'])
+
+    def _demographic_frame(self):
+        rows = [(*key, count) for key, count in sorted(self.demographics.items())]
+        frame = pd.DataFrame(rows, columns=DEMOGRAPHIC_KEYS + ['count'])
+        frame['year'] = frame['year'].astype('int32')
+        return frame
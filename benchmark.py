@@ -0,0 +1,355 @@
+# Benchmarks for the EnforceIQ data pipeline.
+#
+#   python benchmark.py clean --rows 1000000 --chunksize 100000
+#   python benchmark.py suite --rows 100000 1000000 10000000 --output bench.json
+#   python benchmark.py suite --url postgresql+psycopg2://postgres@localhost/bench --compare bench.json
+#
+# "clean" compares the original whole-frame cleaning function against the
+# chunked streaming pipeline (clean + compact per chunk) on synthetic stops
+# and reports throughput and peak Python memory of each.
+#
+# "suite" loads synthetic stops (see synthetic.py) into SQLite (a temporary
+# file by default) or the database given by --url, then times the dashboard's
+# hot paths: data load and clean_data, the Key Metrics block, the
+# demographics groupby, figures and their JSON, the approximate-mode
+# sketches, the prediction filter, the batch prediction model and every canned
+# query, on the loaded database and on the embedded DuckDB engine. Results
+# are JSON; --compare flags stages that got slower than a previous run.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+from sqlalchemy import create_engine, text
+
+from charts import demographics_figure, demographics_heatmap, summary_figure, violations_figure
+from dataset import CHUNK_SIZE, clean_chunk, clean_chunks, clean_data
+from aggregates import AggregateStore
+from prediction import PREDICTION_KEYS, PredictionIndex, PredictionModel
+from embedded import EmbeddedBackend, duckdb_available
+from queries import QUERY_TEMPLATES, build_query
+from rollups import build_rollup, demographics, key_metrics, violation_counts
+from schema import concat_frames, high_cardinality_dtypes
+from sketches import APPROXIMATE_QUERIES, SketchStore, approximate_answer
+from synthetic import load_synthetic, synthetic_stops
+
+# Stages more than this much slower than the --compare run are reported
+REGRESSION_TOLERANCE = 0.10
+
+
+# clean_data as it was before the streaming pipeline, kept as the baseline
+def legacy_clean_data(df):
+    df = df.dropna(axis=1, how='all')
+    for col in ['driver_gender', 'driver_race', 'country_name', 'violation', 'stop_outcome', 'search_type', 'stop_duration']:
+        if col in df.columns:
+            df[col] = df[col].fillna('Unknown')
+    for col in ['search_conducted', 'drugs_related_stop', 'is_arrested']:
+        if col in df.columns:
+            df[col] = df[col].fillna(False).astype(bool)
+    if 'driver_age' in df.columns:
+        df['driver_age'] = pd.to_numeric(df['driver_age'], errors='coerce')
+        df['driver_age'] = df['driver_age'].fillna(df['driver_age'].median()).astype(int)
+    if 'stop_date' in df.columns:
+        df['stop_date'] = pd.to_datetime(df['stop_date'], errors='coerce')
+    if 'stop_time' in df.columns:
+        df['stop_time'] = pd.to_datetime(df['stop_time'], errors='coerce').dt.time
+    return df
+
+
+# Wall time, throughput and peak traced memory of fn()
+def measure(fn, rows):
+    tracemalloc.start()
+    started = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds) if seconds else None,
+        'peak_mb': round(peak / 2**20, 1),
+    }
+
+
+def bench_clean(rows, chunksize=CHUNK_SIZE, seed=0):
+    raw = synthetic_stops(rows, seed)
+    age_median = pd.to_numeric(raw['driver_age'], errors='coerce').median()
+
+    def chunked():
+        chunks = (raw.iloc[i:i + chunksize].copy() for i in range(0, rows, chunksize))
+        return concat_frames(list(clean_chunks(chunks, age_median)))
+
+    return {
+        'rows': rows,
+        'chunksize': chunksize,
+        'legacy_clean_data': measure(lambda: legacy_clean_data(raw.copy()), rows),
+        'clean_data': measure(lambda: clean_data(raw.copy()), rows),
+        'streaming': measure(chunked, rows),
+    }
+
+
+# Median and best wall time of repeat calls to fn; also returns the last result
+def time_stage(fn, repeat=3):
+    runs, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - started)
+    return {'seconds': round(float(np.median(runs)), 4), 'best': round(min(runs), 4), 'runs': repeat}, result
+
+
+# The prediction form's original full-table filter
+def legacy_prediction_filter(data, driver_gender, driver_age, search_conducted, drugs_related_stop, stop_duration):
+    filtered_data = data[
+        (data['driver_gender'] == driver_gender) &
+        (data['driver_age'] == driver_age) &
+        (data['search_conducted'] == int(search_conducted)) &
+        (data['drugs_related_stop'] == int(drugs_related_stop)) &
+        (data['stop_duration'] == stop_duration)
+    ]
+    if filtered_data.empty:
+        return "warning", "speeding"
+    return filtered_data['stop_outcome'].mode()[0], filtered_data['violation'].mode()[0]
+
+
+# Form submissions for the prediction benchmark
+def prediction_inputs(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        (str(rng.choice(['M', 'F'])), int(rng.integers(16, 80)), str(rng.integers(0, 2)),
+         str(rng.integers(0, 2)), str(rng.choice(['0-15 Min', '16-30 Min', '30+ Min'])))
+        for _ in range(count)
+    ]
+
+
+def bench_suite(rows, url=None, chunksize=CHUNK_SIZE, seed=0, repeat=3, predictions=100):
+    workdir = None
+    if url is None:
+        workdir = tempfile.mkdtemp(prefix='enforceiq-bench-')
+        url = f"sqlite:///{os.path.join(workdir, 'traffic_stops.db')}"
+    engine = create_engine(url)
+    stages = {}
+    try:
+        seconds = load_synthetic(engine, rows, chunksize, seed)
+        stages['write_database'] = {'seconds': round(seconds, 4), 'rows_per_second': round(rows / seconds) if seconds else None}
+
+        # Data load as TrafficStopsStore.load does it: stream chunks, clean each
+        # Mean age as the fill value (SQLite has no percentile_cont)
+        with engine.connect() as conn:
+            age_median = conn.execute(text("SELECT AVG(driver_age) FROM traffic_stops")).scalar()
+        read_seconds = clean_seconds = 0.0
+        chunks, text_dtypes = [], None
+        started = time.perf_counter()
+        with engine.connect().execution_options(stream_results=True, max_row_buffer=chunksize) as conn:
+            for raw in pd.read_sql(text("SELECT * FROM traffic_stops"), conn, chunksize=chunksize):
+                read_seconds += time.perf_counter() - started
+                started = time.perf_counter()
+                chunks.append(clean_chunk(raw, age_median, text_dtypes=text_dtypes))
+                text_dtypes = text_dtypes or high_cardinality_dtypes(chunks[0], compacted=True)
+                clean_seconds += time.perf_counter() - started
+                started = time.perf_counter()
+        data = concat_frames(chunks)
+        del chunks
+        stages['read'] = {'seconds': round(read_seconds, 4), 'rows_per_second': round(rows / read_seconds) if read_seconds else None}
+        stages['clean_data'] = {'seconds': round(clean_seconds, 4), 'rows_per_second': round(rows / clean_seconds) if clean_seconds else None}
+
+        # Key Metrics block: rollup of the dataset, then the metric numbers
+        stages['key_metrics'], (rollup, metrics) = time_stage(lambda: _key_metrics(data), repeat)
+        stages['demographics_groupby'], demo_df = time_stage(lambda: demographics(rollup), repeat)
+        summary_df = pd.DataFrame({
+            'Category': ['Total Stops', 'Total Arrests'],
+            'Count': [metrics['total_stops'], metrics['total_arrests']]
+        })
+        violation_df = violation_counts(rollup)
+
+        # The running aggregates the dashboard serves them from: a full
+        # build, folding in a batch of new stops, and reading every widget
+        stages['aggregates_build'], aggregates = time_stage(lambda: _built_aggregates(data), repeat)
+        batch = clean_chunk(synthetic_stops(max(rows // 100, 1), seed + 1, first_id=rows + 1), age_median)
+        stages['aggregates_update'], _ = time_stage(lambda: _updated_aggregates(aggregates, batch), repeat)
+        stages['aggregates_update']['rows'] = len(batch)
+        stages['aggregates_serve'], _ = time_stage(lambda: _served_aggregates(aggregates), repeat)
+
+        # Approximate mode: building the sketches and answering every question
+        stages['sketches_build'], sketches = time_stage(lambda: _built_sketches(data), repeat)
+        stages['sketches_answer'], _ = time_stage(
+            lambda: [approximate_answer(sketches, name) for name in APPROXIMATE_QUERIES], repeat)
+        stages['sketches_answer']['questions'] = len(APPROXIMATE_QUERIES)
+        stages['figures'], figures = time_stage(lambda: (
+            demographics_figure(demo_df), summary_figure(summary_df), violations_figure(violation_df)
+        ), repeat)
+        stages['demographics_heatmap'], _ = time_stage(lambda: demographics_heatmap(demo_df), repeat)
+        # What Streamlit sends to the browser for each figure on a rerun
+        stages['figure_json'], specs = time_stage(lambda: [pio.to_json(fig, validate=False) for fig in figures], repeat)
+        stages['figure_json']['kb'] = round(sum(len(spec) for spec in specs) / 1024, 1)
+
+        inputs = prediction_inputs(predictions, seed)
+        stages['prediction_filter'], _ = time_stage(
+            lambda: [legacy_prediction_filter(data, *stop) for stop in inputs], repeat)
+        stages['prediction_index_build'], index = time_stage(lambda: _built_index(data), repeat)
+        stages['prediction_index_lookup'], _ = time_stage(lambda: [index.predict(*stop) for stop in inputs], repeat)
+        for name in ('prediction_filter', 'prediction_index_lookup'):
+            stages[name]['predictions'] = predictions
+        # The standalone model behind `prediction.py serve`, scoring every loaded stop
+        stages['prediction_model_train'], model = time_stage(lambda: PredictionModel.from_data(data), repeat)
+        stops = data[PREDICTION_KEYS]
+        stages['prediction_batch'], _ = time_stage(lambda: model.predict_batch(stops), repeat)
+        stages['prediction_batch']['stops_per_second'] = round(len(stops) / max(stages['prediction_batch']['seconds'], 1e-9))
+
+        queries = {}
+        for name in QUERY_TEMPLATES:
+            sql, params = build_query(name, engine.dialect.name)
+            try:
+                queries[name], result = time_stage(lambda: pd.read_sql(text(sql), engine, params=params), repeat)
+                queries[name]['rows'] = len(result)
+            except Exception as e:
+                queries[name] = {'error': str(e.__cause__ or e).splitlines()[0]}
+
+        # The same queries on the embedded DuckDB engine over the cleaned frame
+        duckdb_queries = {}
+        if duckdb_available():
+            embedded = EmbeddedBackend(data)
+            for name in QUERY_TEMPLATES:
+                sql, params = build_query(name, 'duckdb')
+                try:
+                    duckdb_queries[name], result = time_stage(lambda: embedded.query(sql, params), repeat)
+                    duckdb_queries[name]['rows'] = len(result)
+                except Exception as e:
+                    duckdb_queries[name] = {'error': str(e).splitlines()[0]}
+    finally:
+        engine.dispose()
+        if workdir:
+            for name in os.listdir(workdir):
+                os.remove(os.path.join(workdir, name))
+            os.rmdir(workdir)
+
+    return {
+        'rows': rows,
+        'chunksize': chunksize,
+        'dialect': engine.dialect.name,
+        'memory_mb': round(int(data.memory_usage(deep=True).sum()) / 2**20, 1),
+        'stages': stages,
+        'queries': queries,
+        'duckdb_queries': duckdb_queries,
+    }
+
+
+def _key_metrics(data):
+    rollup = build_rollup(data)
+    return rollup, key_metrics(rollup)
+
+
+def _built_aggregates(data):
+    aggregates = AggregateStore()
+    aggregates.build(data)
+    return aggregates
+
+
+# Fold the batch in and take it out again, so repeats start from the same state
+def _updated_aggregates(aggregates, batch):
+    aggregates.update(batch)
+    aggregates.update(None, batch)
+
+
+def _served_aggregates(aggregates):
+    aggregates.update(None)  # drop the served frames, as a sync does
+    return aggregates.metrics(), aggregates.violation_counts(), aggregates.demographic_counts()
+
+
+def _built_sketches(data):
+    sketches = SketchStore()
+    sketches.build(data)
+    return sketches
+
+
+def _built_index(data):
+    index = PredictionIndex()
+    index.build(data)
+    index.model()
+    return index
+
+
+# Stages and queries that are slower than in a previous run, as
+# (size, name, previous seconds, current seconds)
+def compare_results(previous, current, tolerance=REGRESSION_TOLERANCE):
+    slower = []
+    old_runs = {run['rows']: run for run in previous.get('results', [])}
+    for run in current['results']:
+        old = old_runs.get(run['rows'])
+        if old is None:
+            continue
+        for section in ('stages', 'queries', 'duckdb_queries'):
+            for name, stat in run.get(section, {}).items():
+                before = old.get(section, {}).get(name, {}).get('seconds')
+                after = stat.get('seconds')
+                if before and after and after > before * (1 + tolerance):
+                    slower.append((run['rows'], name, before, after))
+    return slower
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EnforceIQ pipeline benchmarks")
+    parser.add_argument('benchmark', choices=['clean', 'suite'])
+    parser.add_argument('--rows', type=int, nargs='+', default=None,
+                        help="row counts (default: 1000000 for clean, 100000 for suite)")
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help="suite: SQLAlchemy URL to load the synthetic stops into (default: temporary SQLite file)")
+    parser.add_argument('--repeat', type=int, default=3, help="suite: runs per timed stage")
+    parser.add_argument('--output', help="write the JSON results to this file")
+    parser.add_argument('--compare', help="suite: previous JSON results to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help="suite: slowdown allowed by --compare (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    if args.benchmark == 'clean':
+        rows = args.rows or [1_000_000]
+        results = [bench_clean(n, args.chunksize, args.seed) for n in rows]
+        results = results[0] if len(results) == 1 else {'results': results}
+    else:
+        rows = args.rows or [100_000]
+        results = {
+            'suite': 'hot-paths',
+            'seed': args.seed,
+            'environment': environment(),
+            'results': [bench_suite(n, args.url, args.chunksize, args.seed, args.repeat) for n in rows],
+        }
+    results['run_at'] = datetime.datetime.now().isoformat(timespec='seconds')
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            slower = compare_results(json.load(f), results, args.tolerance)
+        for size, name, before, after in slower:
+            print(f"slower at {size:,} rows: {name}: {before:.4f}s -> {after:.4f}s", file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
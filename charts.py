@@ -0,0 +1,112 @@
+# Plotly figures shown in the dashboard tabs, built from the aggregate
+# frames. Kept out of testproject.py so the benchmarks time exactly the
+# figures the dashboard draws.
+#
+# Chart data is kept small before it reaches Plotly: categories beyond the
+# top CHART_TOP_N are folded into "Other", the demographics chart switches
+# from faceted bars to one aggregated heatmap once it would draw more than
+# CHART_HEATMAP_POINTS bars, and built figures are cached per data version
+# so reruns and other sessions do not rebuild them.
+
+import os
+
+import plotly.express as px
+import streamlit as st
+
+from profiling import timed
+
+CHART_TOP_N = int(os.environ.get("ENFORCEIQ_CHART_TOP_N", "8"))
+CHART_HEATMAP_POINTS = int(os.environ.get("ENFORCEIQ_CHART_HEATMAP_POINTS", "1500"))
+CHART_CACHE_ENTRIES = int(os.environ.get("ENFORCEIQ_CHART_CACHE_ENTRIES", "32"))
+
+OTHER = 'Other'
+
+
+# Keep the top_n values of column (by total value) and sum the rest into one
+# "Other" row per remaining key
+def cap_categories(frame, column, value='count', top_n=CHART_TOP_N):
+    totals = frame.groupby(column, observed=True)[value].sum().sort_values(ascending=False, kind='stable')
+    if len(totals) <= top_n:
+        return frame
+    labels = frame[column].astype(object).where(frame[column].isin(totals.index[:top_n]), OTHER)
+    keys = [col for col in frame.columns if col != value]
+    return frame.assign(**{column: labels}).groupby(keys, sort=False)[value].sum().reset_index()
+
+
+# Figure built by build(frame), shared per chart name and data version (the
+# frame itself is not hashed: the charts cover the whole dataset, so it is
+# determined by the data version). Only builds are timed, as 'chart: <name>';
+# cache hits are not recorded.
+@st.cache_resource(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def cached_figure(name, data_version, _build, _frame):
+    with timed(f'chart: {name}', 'chart'):
+        return _build(_frame)
+
+
+# TAB 1: outcomes by gender, year and country
+def demographics_figure(demo_df):
+    demo_df = cap_categories(demo_df, 'country_name')
+    if len(demo_df) > CHART_HEATMAP_POINTS:
+        return demographics_heatmap(demo_df)
+
+    fig = px.bar(
+        demo_df,
+        x='year',
+        y='count',
+        color='stop_outcome',
+        barmode='group',
+        facet_col='driver_gender',
+        facet_row='country_name',
+        title='📊 Traffic Stop Outcomes by Gender, Year, and Country',
+        color_discrete_sequence=px.colors.qualitative.Set1
+    )
+
+    fig.update_layout(
+        xaxis_title='Year',
+        yaxis_title='Number of Stops',
+        title_x=0.3,
+        height=max(800, 200 * demo_df['country_name'].nunique())
+    )
+    return fig
+
+
+# TAB 1 for large breakdowns: one cell per (country, outcome) and year
+def demographics_heatmap(demo_df):
+    cells = demo_df.assign(
+        year=demo_df['year'].astype(str),
+        group=demo_df['country_name'].astype(str) + ' · ' + demo_df['stop_outcome'].astype(str),
+    )
+    fig = px.density_heatmap(
+        cells, x='year', y='group', z='count', histfunc='sum',
+        facet_col='driver_gender',
+        title='📊 Traffic Stop Outcomes by Gender, Year, and Country',
+        color_continuous_scale='Reds'
+    )
+    fig.update_layout(
+        xaxis_title='Year',
+        yaxis_title='Country · Outcome',
+        title_x=0.3,
+        height=max(600, 22 * cells['group'].nunique())
+    )
+    return fig
+
+
+# TAB 2: total stops and arrests
+def summary_figure(summary_df):
+    fig = px.bar(
+        summary_df, x='Category', y='Count',
+        color='Category', text='Count',
+        title='🚓 Summary of Traffic Stops Metrics',
+        color_discrete_sequence=px.colors.qualitative.Set1
+    )
+    fig.update_layout(title_x=0.3)
+    return fig
+
+
+# TAB 3: share of each violation
+def violations_figure(violation_df):
+    return px.pie(
+        cap_categories(violation_df, 'Violation', value='Count'), names='Violation', values='Count',
+        title='📛 Violation Distribution',
+        color_discrete_sequence=px.colors.sequential.Greens
+    )
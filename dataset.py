@@ -0,0 +1,497 @@
+# Shared, process-wide copy of the cleaned traffic_stops table.
+# Streamlit re-executes testproject.py on every widget interaction, so the
+# table is loaded and cleaned once per server process and every rerun (and
+# every session) reads the same in-memory frame instead of hitting PostgreSQL.
+
+import os
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+
+from db import get_engine
+from profiling import timed
+from shared import SHARED_DIR, SHARED_MEMORY, SHARED_POLL_SECONDS, attach_shared, read_shared_manifest
+from snapshot import SNAPSHOT_DIR, read_snapshot, write_snapshot
+from tasks import submit
+from schema import (
+    STRING_COLUMNS, BOOL_COLUMNS, column_memory, compact_frame, concat_frames, high_cardinality_dtypes,
+    memory_footprint, seconds_to_time, time_to_seconds,
+)
+
+# Seconds the cleaned dataset is kept before it is reloaded from the database
+DATA_TTL = int(os.environ.get("ENFORCEIQ_DATA_TTL", "3600"))
+
+# Incremental sync: how new rows are detected and how often to look for them.
+#   timestamp - stop_date/stop_time high-water mark (default, append only)
+#   id        - monotonically increasing ENFORCEIQ_ID_COLUMN (append only)
+#   xmin      - PostgreSQL row version; also picks up updated rows (needs ENFORCEIQ_ID_COLUMN)
+SYNC_MODE = os.environ.get("ENFORCEIQ_SYNC_MODE", "timestamp")
+ID_COLUMN = os.environ.get("ENFORCEIQ_ID_COLUMN", "id")
+SYNC_INTERVAL = int(os.environ.get("ENFORCEIQ_SYNC_INTERVAL", "60"))
+# Longest wait between retries while syncs keep failing (the interval doubles per failure)
+SYNC_MAX_BACKOFF = int(os.environ.get("ENFORCEIQ_SYNC_MAX_BACKOFF", "900"))
+
+# Keep the cleaned frame in the compact schema (categoricals, uint8 ages, ...)
+COMPACT = os.environ.get("ENFORCEIQ_COMPACT", "1") != "0"
+
+# Start from the local Parquet snapshot when one exists (see snapshot.py)
+USE_SNAPSHOT = os.environ.get("ENFORCEIQ_USE_SNAPSHOT", "1") != "0"
+
+# Serve the local snapshot without PostgreSQL: no sync, canned queries on
+# DuckDB (see embedded.py). Needs a snapshot in ENFORCEIQ_SNAPSHOT_DIR.
+OFFLINE = os.environ.get("ENFORCEIQ_OFFLINE", "0") != "0"
+
+# Rows per chunk when streaming the table out of PostgreSQL
+CHUNK_SIZE = int(os.environ.get("ENFORCEIQ_CHUNK_SIZE", "100000"))
+
+
+#Cleaning Function
+
+# age_median lets incremental batches reuse the fill value of the full table,
+# drop_empty=False keeps columns that happen to be empty in a small batch and
+# time_as_seconds keeps stop_time as seconds since midnight instead of
+# building a datetime.time object per row
+def clean_data(df, age_median=None, drop_empty=True, time_as_seconds=False):
+    # Drop columns where all values are NaN
+    if drop_empty:
+        df = df.dropna(axis=1, how='all')
+
+    # Fill missing string fields
+    for col in STRING_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].fillna('Unknown')
+
+    # Fill missing boolean fields
+    for col in BOOL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].fillna(False).astype(bool)
+
+    # Fill missing ages with median and convert to int
+    if 'driver_age' in df.columns:
+        df['driver_age'] = pd.to_numeric(df['driver_age'], errors='coerce')
+        if age_median is None:
+            age_median = df['driver_age'].median()
+        df['driver_age'] = df['driver_age'].fillna(age_median).astype(int)
+
+    # Format date and time columns (fixed formats, no per-row format guessing)
+    if 'stop_date' in df.columns:
+        df['stop_date'] = pd.to_datetime(df['stop_date'], format='%Y-%m-%d', errors='coerce')
+    if 'stop_time' in df.columns:
+        seconds = time_to_seconds(df['stop_time'])
+        df['stop_time'] = seconds if time_as_seconds else seconds_to_time(seconds)
+
+    return df
+
+
+# Median driver age of the whole table, computed by PostgreSQL so that
+# chunks can be cleaned independently with the same fill value
+def global_age_median():
+    with get_engine().connect() as conn:
+        median = conn.execute(text(
+            "SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY driver_age) FROM traffic_stops"
+        )).scalar()
+    return None if median is None else float(median)
+
+
+# Stream query results in chunks through a server-side cursor, so only
+# chunksize raw rows are held in memory at a time
+def read_chunks(sql, chunksize=CHUNK_SIZE, params=None):
+    with get_engine().connect().execution_options(stream_results=True, max_row_buffer=chunksize) as conn:
+        yield from pd.read_sql(text(sql), conn, params=params, chunksize=chunksize)
+
+
+# Clean (and compact) one raw chunk. Columns that are empty in the chunk are
+# kept; callers drop the ones that turn out to be empty overall. text_dtypes
+# (schema.high_cardinality_dtypes of the first chunk or of the loaded data)
+# keeps the free-text columns in the same dtype across chunks.
+def clean_chunk(raw, age_median, compact=COMPACT, text_dtypes=None):
+    cleaned = clean_data(raw, age_median=age_median, drop_empty=False, time_as_seconds=compact)
+    return compact_frame(cleaned, text_dtypes=text_dtypes) if compact else cleaned
+
+
+def clean_chunks(raw_chunks, age_median, compact=COMPACT):
+    text_dtypes = None
+    for raw in raw_chunks:
+        chunk = clean_chunk(raw, age_median, compact, text_dtypes)
+        text_dtypes = text_dtypes or high_cardinality_dtypes(chunk, compacted=True)
+        yield chunk
+
+
+# Combined stop_date + stop_time of cleaned rows (NaT where either is missing)
+def _stop_timestamps(df):
+    seconds = time_to_seconds(df['stop_time']).astype('float64')
+    return pd.to_datetime(df['stop_date']) + pd.to_timedelta(seconds, unit='s')
+
+
+# Fingerprint per cleaned row, used to recognise already-loaded stops.
+# Datetimes are hashed at a fixed unit so snapshot round-trips match.
+def _row_hashes(df):
+    canonical = df.astype({
+        col: 'datetime64[s]' for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])
+    })
+    return pd.util.hash_pandas_object(canonical, index=False)
+
+
+# Holds the single cleaned copy of traffic_stops for this server process.
+# The frame is shared between sessions, so callers must treat it as read-only:
+# updates build a new frame and swap it in.
+class TrafficStopsStore:
+    def __init__(self, sync_mode=SYNC_MODE):
+        self.sync_mode = sync_mode
+        self.data = None
+        self.loaded_at = None
+        self.synced_at = None
+        self.version = 0
+        self.age_median = None
+        self.watermark = None
+        self.memory = None
+        self.source = None
+        self.derived = {}
+        self.shared_version = None  # published version attached in shared-memory mode
+        self.sync_failures = 0      # consecutive failed syncs
+        self.sync_error = None      # message of the last failed sync
+        self._sync_task = None
+        self._boundary_hashes = set()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    # Stream the full table out of PostgreSQL and clean it chunk by chunk;
+    # peak memory is bounded by the chunk size plus the compact result
+    def load(self, chunksize=CHUNK_SIZE):
+        return self.load_chunks(read_chunks(self._select_sql(), chunksize), global_age_median())
+
+    # Clean and keep raw chunks from any source (e.g. pd.read_csv(..., chunksize=...))
+    def load_chunks(self, raw_chunks, age_median, source='database'):
+        # Whole load (read + clean + concat) is timed as one stage; each chunk's
+        # cleaning is also timed on its own
+        with timed('load traffic_stops', 'load') as load_timing:
+            chunks, non_null, before, xmin, text_dtypes = [], None, None, None, None
+            for raw in raw_chunks:
+                if '_xmin' in raw.columns:
+                    chunk_xmin = int(raw.pop('_xmin').max())
+                    xmin = chunk_xmin if xmin is None else max(xmin, chunk_xmin)
+                counts = raw.notna().sum()
+                non_null = counts if non_null is None else non_null.add(counts, fill_value=0)
+                raw_bytes = column_memory(raw)
+                before = raw_bytes if before is None else before.add(raw_bytes, fill_value=0)
+                with timed('clean_data') as timing:
+                    chunks.append(timing.observe(clean_chunk(raw, age_median, text_dtypes=text_dtypes)))
+                text_dtypes = text_dtypes or high_cardinality_dtypes(chunks[0], compacted=True)
+
+            data = concat_frames(chunks)
+            del chunks
+            # Same rule as clean_data: columns with no values at all are dropped
+            if non_null is not None:
+                empty = [col for col, count in non_null.items() if count == 0 and col in data.columns]
+                data = data.drop(columns=empty)
+            load_timing.observe(data)
+        with self._lock:
+            self.watermark, self._boundary_hashes = None, set()
+            self._track_watermark(data, xmin)
+            self.age_median = age_median
+            self.memory = {
+                'before': int(before.sum()) if before is not None else 0,
+                'after': memory_footprint(data),
+                'columns_before': before,  # raw bytes per column, for schema.memory_report
+            }
+            self.source = source
+            self.data = data
+            self.loaded_at = self.synced_at = time.time()
+            self.version += 1
+            self._rebuild_derived()
+        return data
+
+    # Identifies the current contents of the store; changes on every load and sync
+    @property
+    def data_version(self):
+        return (self.loaded_at, self.version)
+
+    # Start from previously saved data and sync state instead of the database
+    def restore(self, data, state):
+        with self._lock:
+            self.sync_mode = state['sync_mode']
+            self.watermark = state['watermark']
+            self._boundary_hashes = set(state['boundary_hashes'])
+            self.age_median = state['age_median']
+            self.memory = {'before': None, 'after': memory_footprint(data)}
+            self.source = 'snapshot'
+            self.data = data
+            self.loaded_at = self.synced_at = time.time()
+            self.version += 1
+            self._rebuild_derived()
+
+    # Swap in a version published by the loader process (shared-memory mode).
+    # When it only appends rows to the current data, derived structures are
+    # updated with those rows instead of being rebuilt.
+    def attach(self, data, state, shared_version, appended=False):
+        with self._lock:
+            previous = self.data
+            self.sync_mode = state['sync_mode']
+            self.watermark = state['watermark']
+            self._boundary_hashes = set(state['boundary_hashes'])
+            self.age_median = state['age_median']
+            self.memory = {'before': None, 'after': memory_footprint(data)}
+            self.source = 'shared memory'
+            self.shared_version = shared_version
+            self.data = data
+            self.loaded_at = self.loaded_at or time.time()
+            self.synced_at = time.time()
+            self.version += 1
+            if appended and previous is not None:
+                delta = data.iloc[len(previous):]
+                for derived in self.derived.values():
+                    derived.update(delta)
+            else:
+                self._rebuild_derived()
+
+    # Derived structures (indexes, aggregates) kept in step with the data.
+    # Each one has build(data) for a full rebuild and update(delta, removed)
+    # for incremental batches; removed holds rows replaced in xmin mode.
+    def get_derived(self, name, factory):
+        with self._lock:
+            derived = self.derived.get(name)
+            if derived is None:
+                derived = factory()
+                derived.build(self.data)
+                self.derived[name] = derived
+            return derived
+
+    def _rebuild_derived(self):
+        for derived in self.derived.values():
+            derived.build(self.data)
+
+    # Everything needed to resume incremental sync later
+    def sync_state(self):
+        with self._lock:
+            return {
+                'sync_mode': self.sync_mode,
+                'watermark': self.watermark,
+                'boundary_hashes': set(self._boundary_hashes),
+                'age_median': self.age_median,
+            }
+
+    # Fetch rows added (or changed, in xmin mode) since the last load/sync,
+    # clean only that delta and append it. Returns the number of rows merged.
+    # Failures are logged and retried with back-off; the current data keeps
+    # being served meanwhile. With wait, a sync already in flight is waited
+    # for and then followed by another one, so rows committed before the call
+    # are always picked up.
+    def sync(self, wait=False):
+        if SHARED_MEMORY:
+            return self._sync_shared()
+        if OFFLINE:
+            return 0
+        # Only one caller syncs at a time; the others keep serving current data
+        if not self._sync_lock.acquire(blocking=wait):
+            return 0
+        try:
+            new_rows = self._sync_delta()
+        except Exception as e:
+            self._sync_failed(e)
+            return 0
+        finally:
+            self._sync_lock.release()
+        self.sync_failures, self.sync_error = 0, None
+        return new_rows
+
+    # Load the whole table again from the database (never from the snapshot)
+    # for changes a delta sync cannot see, such as back-filled stops older
+    # than the watermark. The snapshot is rewritten so later restores have
+    # them too. Returns the number of rows loaded.
+    def reload(self):
+        with self._sync_lock:
+            self.load()
+            if USE_SNAPSHOT:
+                try:
+                    write_snapshot(self.data, self.sync_state(), SNAPSHOT_DIR)
+                except Exception as e:
+                    print(f"Error writing snapshot: {e}")
+        self.sync_failures, self.sync_error = 0, None
+        return len(self.data)
+
+    def _sync_delta(self):
+        # Nothing to sync from yet: fall back to a full load
+        if self.data is None or self.watermark is None:
+            self.load()
+            return len(self.data)
+        chunks, xmin = [], None
+        text_dtypes = high_cardinality_dtypes(self.data, compacted=True)
+        for raw in self._fetch_delta():
+            if '_xmin' in raw.columns:
+                chunk_xmin = int(raw.pop('_xmin').max())
+                xmin = chunk_xmin if xmin is None else max(xmin, chunk_xmin)
+            with timed('clean_data') as timing:
+                chunks.append(timing.observe(clean_chunk(raw, self.age_median, text_dtypes=text_dtypes)))
+        self.synced_at = time.time()
+        chunks = [chunk for chunk in chunks if len(chunk)]
+        if not chunks:
+            return 0
+        delta = concat_frames(chunks).reindex(columns=self.data.columns)
+
+        # Timestamp mode re-reads the rows sharing the last timestamp;
+        # drop the ones that are already loaded
+        if self.sync_mode == 'timestamp':
+            at_boundary = (_stop_timestamps(delta) == self.watermark).to_numpy()
+            if at_boundary.any():
+                seen = _row_hashes(delta).isin(self._boundary_hashes).to_numpy()
+                delta = delta[~(at_boundary & seen)]
+            if delta.empty:
+                return 0
+
+        data, removed = self.data, None
+        if self.sync_mode == 'xmin':
+            # Updated rows replace their previous version
+            replaced = data[ID_COLUMN].isin(delta[ID_COLUMN])
+            data, removed = data[~replaced], data[replaced]
+        with self._lock:
+            self._track_watermark(delta, xmin)
+            self.data = concat_frames([data, delta])
+            self.version += 1
+            for derived in self.derived.values():
+                derived.update(delta, removed)
+        return len(delta)
+
+    # Log the failure and count it as a sync, so the next attempt waits for
+    # the (backed-off) interval instead of running on every rerun
+    def _sync_failed(self, error):
+        self.sync_failures += 1
+        self.sync_error = str(getattr(error, 'orig', None) or error).splitlines()[0]
+        self.synced_at = time.time()
+        print(f"Error syncing traffic stops (attempt {self.sync_failures}, "
+              f"retrying in {self.sync_interval():.0f}s): {self.sync_error}")
+
+    # Seconds between syncs: ENFORCEIQ_SHARED_POLL_SECONDS in shared-memory
+    # mode, otherwise SYNC_INTERVAL doubled per consecutive failure
+    def sync_interval(self):
+        if SHARED_MEMORY:
+            return SHARED_POLL_SECONDS
+        return min(SYNC_INTERVAL * 2 ** self.sync_failures, max(SYNC_MAX_BACKOFF, SYNC_INTERVAL))
+
+    # Start a sync on the task pool if the last one is older than the sync
+    # interval. The current rerun keeps the data it has; new stops show up
+    # on the next rerun. Returns the running sync task, if any.
+    def sync_if_stale(self):
+        if self._sync_task is not None and not self._sync_task.done():
+            return self._sync_task
+        if self.synced_at is None or time.time() - self.synced_at >= self.sync_interval():
+            self._sync_task = submit(self.sync, name="Syncing new stops")
+            return self._sync_task
+        return None
+
+    # Shared-memory mode: attach the loader's newest version if it is not
+    # the one already attached. Returns the number of rows added.
+    def _sync_shared(self):
+        manifest = read_shared_manifest()
+        self.synced_at = time.time()
+        if manifest is None or manifest['version'] == self.shared_version:
+            return 0
+        try:
+            data, state = attach_shared(manifest)
+        except FileNotFoundError:
+            # Superseded while we read the manifest; the next poll gets the newer one
+            return 0
+        before = 0 if self.data is None else len(self.data)
+        appended = self.shared_version is not None and manifest['append_of'] == self.shared_version
+        self.attach(data, state, manifest['version'], appended)
+        return len(data) - before
+
+    def _select_sql(self):
+        if self.sync_mode == 'xmin':
+            return "SELECT *, xmin::text::bigint AS _xmin FROM traffic_stops"
+        return "SELECT * FROM traffic_stops"
+
+    # Raw delta rows, streamed in CHUNK_SIZE pieces so a large catch-up
+    # (e.g. after a long outage) is never held in memory raw all at once
+    def _fetch_delta(self, chunksize=CHUNK_SIZE):
+        if self.sync_mode == 'id':
+            query = f"SELECT * FROM traffic_stops WHERE {ID_COLUMN} > :wm"
+            params = {'wm': self.watermark}
+        elif self.sync_mode == 'xmin':
+            query = f"{self._select_sql()} WHERE xmin::text::bigint > :wm"
+            params = {'wm': self.watermark}
+        else:
+            # >= on the time so stops sharing the last timestamp are not lost
+            query = (
+                "SELECT * FROM traffic_stops "
+                "WHERE stop_date > :wm_date OR (stop_date = :wm_date AND stop_time >= :wm_time)"
+            )
+            params = {'wm_date': self.watermark.date(), 'wm_time': self.watermark.time()}
+        # Timed from the first to the last chunk (like the full load, this
+        # includes cleaning the chunks as they arrive)
+        with timed(f'sync delta ({self.sync_mode})', 'sql', sql=query, params=params) as timing:
+            timing.rows = 0
+            for raw in read_chunks(query, chunksize, params):
+                timing.rows += len(raw)
+                yield raw
+
+    # Advance the high-water mark past the cleaned rows in df
+    def _track_watermark(self, df, xmin=None):
+        if df.empty:
+            return
+        if self.sync_mode == 'xmin':
+            self.watermark = max(self.watermark or 0, xmin)
+        elif self.sync_mode == 'id':
+            self.watermark = max(self.watermark or 0, int(df[ID_COLUMN].max()))
+        else:
+            stamps = _stop_timestamps(df)
+            latest = stamps.max()
+            if pd.isna(latest):
+                return
+            boundary = set(_row_hashes(df[(stamps == latest).to_numpy()]))
+            if latest == self.watermark:
+                self._boundary_hashes.update(boundary)
+            elif self.watermark is None or latest > self.watermark:
+                self.watermark = latest
+                self._boundary_hashes = boundary
+
+
+@st.cache_resource(ttl=DATA_TTL, show_spinner="Loading traffic stops...")
+def get_store():
+    store = TrafficStopsStore()
+    if SHARED_MEMORY:
+        # Map the dataset published by the loader process (python shared.py serve)
+        store.sync()
+        if store.data is None:
+            raise RuntimeError(
+                f"ENFORCEIQ_SHARED_MEMORY is set but no dataset is published in {SHARED_DIR} "
+                "(start the loader with: python shared.py serve)"
+            )
+        return store
+    if OFFLINE:
+        if not restore_snapshot(store):
+            raise RuntimeError(
+                f"ENFORCEIQ_OFFLINE is set but there is no usable snapshot in {SNAPSHOT_DIR} "
+                "(build one with: python snapshot.py build --from-csv stops.csv)"
+            )
+        return store
+    if USE_SNAPSHOT and restore_snapshot(store):
+        # Serve the snapshot right away and catch up with PostgreSQL on the
+        # task pool; if the database is unreachable the snapshot keeps being
+        # served and the sync is retried with back-off
+        store._sync_task = submit(store.sync, name="Reconciling snapshot")
+    else:
+        store.load()
+    return store
+
+
+# Load the local snapshot into store; False if there is none or it is unusable
+def restore_snapshot(store):
+    try:
+        data, state = read_snapshot(SNAPSHOT_DIR)
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        print(f"Ignoring snapshot at {SNAPSHOT_DIR}: {e}")
+        return False
+    if state['sync_mode'] != store.sync_mode:
+        return False
+    store.restore(data, state)
+    return True
+
+
+# Drop the cached dataset so the next rerun reloads it from the database
+def invalidate_dataset():
+    get_store.clear()
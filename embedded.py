@@ -0,0 +1,141 @@
+# Embedded DuckDB engine for the canned queries.
+# DuckDB scans the cleaned in-memory frame (or the local Parquet snapshot)
+# with its vectorized, columnar engine, so whole-table aggregations do not
+# need a round trip to PostgreSQL, and the dashboard can run with no
+# database server at all (ENFORCEIQ_OFFLINE=1).
+#
+# ENFORCEIQ_QUERY_BACKEND picks where canned queries run:
+#   postgres - everything on PostgreSQL (default)
+#   auto     - aggregations on DuckDB, except those the rollup view answers;
+#              lookups on PostgreSQL
+#   duckdb   - everything on DuckDB
+# DuckDB scans the cleaned frame ('Unknown' fills, median-imputed ages), so
+# its answers can differ slightly from PostgreSQL's for the same query.
+# Results from either engine go through the shared query result cache.
+
+import os
+import threading
+from functools import lru_cache
+
+import streamlit as st
+
+from dataset import OFFLINE
+from profiling import timed
+from queries import ANALYTICAL_QUERIES, bind_names, build_query
+from query_cache import cached_fetch
+from rollups import ROLLUP_QUERIES, route_query
+from schema import time_to_seconds
+from snapshot import SNAPSHOT_DIR, read_manifest
+
+QUERY_BACKEND = os.environ.get("ENFORCEIQ_QUERY_BACKEND", "postgres")
+# What DuckDB reads: 'memory' (the shared cleaned frame) or 'parquet' (the snapshot files)
+EMBEDDED_SOURCE = os.environ.get("ENFORCEIQ_EMBEDDED_SOURCE", "memory")
+
+
+@lru_cache(maxsize=1)
+def duckdb_available():
+    try:
+        import duckdb  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class EmbeddedBackend:
+    # data: cleaned traffic_stops frame; parquet_path: snapshot directory
+    def __init__(self, data=None, parquet_path=None):
+        import duckdb
+
+        self.conn = duckdb.connect(database=':memory:')
+        self._lock = threading.Lock()
+        if data is not None:
+            self.conn.register('traffic_stops_frame', data)
+            source = 'traffic_stops_frame'
+        else:
+            pattern = os.path.join(parquet_path, '**', '*.parquet')
+            source = f"read_parquet('{pattern}', hive_partitioning = true)"
+        self.conn.execute(f"CREATE VIEW traffic_stops AS {self._select(source)}")
+
+    # Present the cleaned columns with the SQL types the queries expect:
+    # stop_date as DATE and stop_time as TIME (the compact schema keeps it
+    # as seconds since midnight)
+    def _select(self, source):
+        types = {row[0]: row[1] for row in self.conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()}
+        replace = []
+        if 'stop_date' in types:
+            replace.append("cast(stop_date as date) AS stop_date")
+        if 'stop_time' in types:
+            if 'INT' in types['stop_time'].upper():
+                replace.append("TIME '00:00:00' + to_seconds(stop_time) AS stop_time")
+            else:
+                replace.append("cast(stop_time as time) AS stop_time")
+        exclude = " EXCLUDE (year)" if 'year' in types else ""
+        replace = f" REPLACE ({', '.join(replace)})" if replace else ""
+        return f"SELECT *{exclude}{replace} FROM {source}"
+
+    # cancel (tasks.CancelToken) interrupts the statement while it runs
+    def query(self, sql, params=None, cancel=None):
+        with self._lock:
+            if cancel is None:
+                return self.conn.execute(sql, params or {}).df()
+            with cancel.attach(self.conn.interrupt):
+                try:
+                    return self.conn.execute(sql, params or {}).df()
+                except Exception:
+                    cancel.check()
+                    raise
+
+
+# DuckDB over the current dataset version (rebuilt when it changes)
+@st.cache_resource(max_entries=1, show_spinner=False)
+def get_embedded_backend(_store, data_version):
+    if EMBEDDED_SOURCE == 'parquet':
+        return EmbeddedBackend(parquet_path=SNAPSHOT_DIR)
+    data = _store.data
+    if 'stop_time' in data.columns and data['stop_time'].dtype == object:
+        data = data.assign(stop_time=time_to_seconds(data['stop_time']))
+    return EmbeddedBackend(data)
+
+
+# Dialect of the backend that runs the canned query name: 'duckdb' or 'postgresql'
+def query_backend(name):
+    if OFFLINE or QUERY_BACKEND == 'duckdb':
+        return 'duckdb'
+    # Queries the rollup view answers stay on PostgreSQL, where route_query
+    # can send them to the view
+    if QUERY_BACKEND == 'auto' and name in ANALYTICAL_QUERIES and name not in ROLLUP_QUERIES and duckdb_available():
+        return 'duckdb'
+    return 'postgresql'
+
+
+# SQL and bound parameters of a canned query as it will be run
+def canned_query(name, filters=None, params=None):
+    return build_query(name, query_backend(name), filters, params)
+
+
+# Run a canned query on its backend, with filters pushed down and params
+# overriding the default thresholds. Returns (result, source) where source
+# is 'duckdb', 'rollup' or 'postgres'; results are served from the query
+# result cache when possible, errors are reported and give an empty frame,
+# a cancelled run raises QueryCancelled.
+def run_canned_query(name, store, filters=None, params=None, cancel=None):
+    sql, bound = canned_query(name, filters, params)
+    if query_backend(name) == 'duckdb':
+        version = store.data_version
+        if EMBEDDED_SOURCE == 'parquet':
+            version = (read_manifest(SNAPSHOT_DIR) or {}).get('created_at')
+
+        def run(sql, bound, name, cancel):
+            backend = get_embedded_backend(store, version)
+            with timed(name, 'duckdb', sql=sql, params=bound) as timing:
+                return timing.observe(backend.query(sql, bound, cancel))
+
+        result = cached_fetch(sql, bound, watermark=store.data_version, name=f"{name} (duckdb)",
+                              cancel=cancel, run=run, source=f"duckdb:{EMBEDDED_SOURCE}:{version}")
+        return result, 'duckdb'
+    routed_sql, from_rollup = route_query(sql, store.data_version)
+    if from_rollup:
+        sql, bound = routed_sql, {key: value for key, value in bound.items() if key in bind_names(routed_sql)}
+    result = cached_fetch(sql, bound, watermark=store.data_version,
+                          name=f"{name} (rollup)" if from_rollup else name, cancel=cancel)
+    return result, 'rollup' if from_rollup else 'postgres'
@@ -0,0 +1,79 @@
+# Indexes that let PostgreSQL answer filtered canned queries and the overview
+# page without scanning all of traffic_stops.
+#
+#   python indexes.py propose   # print the CREATE INDEX statements still missing
+#   python indexes.py create    # create them (CONCURRENTLY, writes keep going)
+
+import argparse
+import sys
+
+from sqlalchemy import text
+
+from db import get_engine
+
+# name -> column list (and optional WHERE for partial indexes)
+SUPPORTING_INDEXES = {
+    'traffic_stops_stop_date_idx': "(stop_date)",
+    'traffic_stops_country_date_idx': "(country_name, stop_date)",
+    'traffic_stops_violation_date_idx': "(violation, stop_date)",
+    # Searched stops are a small share of the table; most search questions
+    # only ever read those rows
+    'traffic_stops_searched_idx': "(stop_date, country_name) WHERE search_conducted = true",
+    'traffic_stops_drugs_idx': "(stop_date, country_name) WHERE drugs_related_stop = true",
+}
+
+
+def index_sql(name, concurrently=True):
+    keyword = "CONCURRENTLY " if concurrently else ""
+    return f"CREATE INDEX {keyword}IF NOT EXISTS {name} ON traffic_stops {SUPPORTING_INDEXES[name]}"
+
+
+def existing_indexes():
+    with get_engine().connect() as conn:
+        rows = conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'traffic_stops'"))
+        return {row[0] for row in rows}
+
+
+# CREATE INDEX statements for the supporting indexes that do not exist yet
+def propose_indexes():
+    present = existing_indexes()
+    return [index_sql(name) for name in SUPPORTING_INDEXES if name not in present]
+
+
+# Create the missing indexes. CREATE INDEX CONCURRENTLY cannot run inside a
+# transaction, so each statement runs in autocommit mode. Returns the names
+# of the indexes created.
+def ensure_indexes(concurrently=True):
+    present = existing_indexes()
+    created = []
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name in SUPPORTING_INDEXES:
+            if name in present:
+                continue
+            conn.execute(text(index_sql(name, concurrently)))
+            created.append(name)
+        if created:
+            conn.execute(text("ANALYZE traffic_stops"))
+    return created
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Propose or create the traffic_stops indexes")
+    parser.add_argument('command', choices=['propose', 'create'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'propose':
+        statements = propose_indexes()
+        for statement in statements:
+            print(f"{statement};")
+        if not statements:
+            print("-- all supporting indexes exist")
+        return 0
+
+    created = ensure_indexes()
+    print(f"Created {len(created)} index(es): {', '.join(created) or 'none needed'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
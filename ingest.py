@@ -0,0 +1,291 @@
+# Ingestion of new police logs into traffic_stops.
+# Single form submissions and bulk CSV/JSONL files are validated with the
+# same rules clean_data applies on load, then written with PostgreSQL COPY in
+# batches. In the dashboard, writes go through a write-behind queue so the
+# page never waits on the database; after every flush the dashboard caches
+# are invalidated.
+#
+#   python ingest.py stops.csv [--batch-size 50000]
+
+import argparse
+import datetime
+import io
+import os
+import queue
+import sys
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+
+from db import get_engine
+from dataset import get_store
+from pagination import estimate_count
+from query_cache import get_result_cache
+from rollups import refresh_rollups_for
+from shared import SHARED_MEMORY, request_reload
+from tasks import submit
+from schema import STRING_COLUMNS, BOOL_COLUMNS, time_string_seconds, time_to_seconds, seconds_to_time_str
+
+INGEST_BATCH_SIZE = int(os.environ.get("ENFORCEIQ_INGEST_BATCH_SIZE", "50000"))
+INGEST_FLUSH_INTERVAL = float(os.environ.get("ENFORCEIQ_INGEST_FLUSH_INTERVAL", "2"))
+
+# Columns accepted from forms and files (everything else is rejected)
+INGEST_COLUMNS = [
+    'stop_date', 'stop_time', 'country_name', 'driver_gender', 'driver_age', 'driver_race',
+    'violation', 'search_conducted', 'search_type', 'stop_outcome', 'is_arrested',
+    'stop_duration', 'drugs_related_stop', 'vehicle_number',
+]
+REQUIRED_COLUMNS = ['stop_date', 'stop_time']
+MAX_DRIVER_AGE = 120
+
+
+BOOL_VALUES = {
+    '1': True, 'true': True, 't': True, 'yes': True, 'y': True,
+    '0': False, 'false': False, 'f': False, 'no': False, 'n': False, '': False,
+}
+
+
+# Seconds since midnight of each stop_time: datetime.time values (forms) or
+# strict "HH:MM:SS" strings with hours 0-23 and minutes/seconds 0-59 (files).
+# Anything else, such as '25:00:00', numbers or trailing text, is NA.
+def stop_time_seconds(times):
+    is_time = times.map(lambda value: isinstance(value, datetime.time)).astype(bool)
+    seconds = time_string_seconds(times.where(~is_time).astype('string').str.strip())
+    if is_time.any():
+        seconds[is_time] = time_to_seconds(times[is_time])
+    return seconds
+
+
+# Split stops into rows ready for COPY and rejected rows (with an 'error'
+# column). Dates and times use the fixed formats clean_data expects, booleans
+# default to False and ages must be numeric; missing text stays NULL and is
+# filled with 'Unknown' by clean_data when loaded.
+def validate_stops(stops):
+    unknown = [col for col in stops.columns if col not in INGEST_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    missing = [col for col in REQUIRED_COLUMNS if col not in stops.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+    stops = stops.reset_index(drop=True)
+    rows = pd.DataFrame(index=stops.index)
+    errors = pd.Series('', index=stops.index)
+
+    dates = pd.to_datetime(stops['stop_date'].astype(str), format='%Y-%m-%d', errors='coerce')
+    errors[dates.isna()] += 'invalid stop_date; '
+    rows['stop_date'] = dates.dt.strftime('%Y-%m-%d')
+
+    seconds = stop_time_seconds(stops['stop_time'])
+    errors[seconds.isna()] += 'invalid stop_time; '
+    rows['stop_time'] = seconds_to_time_str(seconds)
+
+    if 'driver_age' in stops.columns:
+        ages = pd.to_numeric(stops['driver_age'], errors='coerce')
+        given = stops['driver_age'].notna() & (stops['driver_age'].astype(str).str.strip() != '')
+        errors[given & (ages.isna() | (ages < 0) | (ages > MAX_DRIVER_AGE))] += 'invalid driver_age; '
+        rows['driver_age'] = ages.round().astype('Int64')
+
+    for col in BOOL_COLUMNS:
+        if col in stops.columns:
+            text = stops[col].astype('string').str.strip().str.lower()
+            parsed = text.map(BOOL_VALUES)
+            errors[text.notna() & parsed.isna()] += f'invalid {col}; '
+            rows[col] = parsed.fillna(False).astype(bool)
+
+    for col in STRING_COLUMNS + ['vehicle_number']:
+        if col in stops.columns:
+            text = stops[col].astype('string').str.strip()
+            rows[col] = text.where(text != '')
+
+    bad = errors != ''
+    rejected = stops[bad].assign(error=errors[bad].str.rstrip('; '))
+    return rows[~bad].reset_index(drop=True), rejected
+
+
+# Write validated stops with COPY, one transaction per batch.
+# Returns the number of rows written.
+def copy_stops(rows, batch_size=INGEST_BATCH_SIZE):
+    if rows.empty:
+        return 0
+    columns = ', '.join(rows.columns)
+    sql = f"COPY traffic_stops ({columns}) FROM STDIN WITH (FORMAT csv, NULL '')"
+    written = 0
+    conn = get_engine().raw_connection()
+    try:
+        for start in range(0, len(rows), batch_size):
+            batch = rows.iloc[start:start + batch_size]
+            buffer = io.StringIO()
+            batch.to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor = conn.cursor()
+            try:
+                cursor.copy_expert(sql, buffer)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+            written += len(batch)
+    finally:
+        conn.close()
+    return written
+
+
+# Background writer: submitted stops are buffered and written with COPY once
+# INGEST_BATCH_SIZE rows are waiting or INGEST_FLUSH_INTERVAL seconds passed.
+# on_flush(rows) runs after every successful write.
+class WriteBehindQueue:
+    def __init__(self, on_flush=None, batch_size=INGEST_BATCH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL):
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queued = 0
+        self.written = 0
+        self.failed = 0
+        self.last_error = None
+        self._queue = queue.Queue()
+        self._flushed = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    # Queue validated rows (from validate_stops) for writing
+    def submit(self, rows):
+        if len(rows):
+            # Shared by every session: counters change under the same lock
+            with self._flushed:
+                self.queued += len(rows)
+            self._queue.put(rows)
+
+    # Block until everything submitted so far has been written (or failed)
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._flushed:
+            while self.written + self.failed < self.queued:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._flushed.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._flushed:
+            return {
+                'pending': self.queued - self.written - self.failed,
+                'written': self.written,
+                'failed': self.failed,
+                'last_error': self.last_error,
+            }
+
+    def _run(self):
+        pending, pending_rows, oldest = [], 0, None
+        while True:
+            timeout = None if oldest is None else max(0.0, oldest + self.flush_interval - time.monotonic())
+            try:
+                rows = self._queue.get(timeout=timeout)
+                pending.append(rows)
+                pending_rows += len(rows)
+                oldest = oldest or time.monotonic()
+            except queue.Empty:
+                pass
+            due = oldest is not None and time.monotonic() - oldest >= self.flush_interval
+            if pending and (pending_rows >= self.batch_size or due):
+                self._write(pd.concat(pending, ignore_index=True))
+                pending, pending_rows, oldest = [], 0, None
+
+    def _write(self, rows):
+        try:
+            copy_stops(rows, self.batch_size)
+        except Exception as e:
+            print(f"Error writing police logs: {e}")
+            with self._flushed:
+                self.last_error = str(e)
+                self.failed += len(rows)
+                self._flushed.notify_all()
+            return
+        with self._flushed:
+            self.written += len(rows)
+            self._flushed.notify_all()
+        if self.on_flush is not None:
+            try:
+                self.on_flush(rows)
+            except Exception as e:
+                print(f"Error refreshing caches after ingest: {e}")
+
+
+# Make freshly written stops visible on the dashboard: sync them into the
+# shared dataset, drop cached query results and row-count estimates, and
+# start refreshing the rollup view. The router stops answering from the view
+# as soon as the dataset version changes (see rollups.route_query).
+# A batch reaching back before the sync watermark is invisible to a delta
+# sync, so the dataset is reloaded from the database instead, in the
+# background (or by the loader in shared-memory mode); the snapshot is
+# bypassed and rewritten.
+def invalidate_dashboard_caches(rows):
+    store = get_store()
+    oldest = (pd.to_datetime(rows['stop_date']) + pd.to_timedelta(rows['stop_time'])).min()
+    reload = store.sync_mode == 'timestamp' and store.watermark is not None and oldest < store.watermark
+    if reload and SHARED_MEMORY:
+        request_reload()
+    elif reload:
+        submit(_reload_store, store, name="Reloading back-filled stops")
+    else:
+        # Wait out a sync already in flight (it may have started before these
+        # rows were committed) so the rollup refresh below covers them
+        store.sync(wait=True)
+    get_result_cache().clear()
+    estimate_count.clear()
+    if not reload:
+        refresh_rollups_for(store.data_version)
+
+
+def _reload_store(store):
+    try:
+        store.reload()
+    except Exception as e:
+        print(f"Error reloading traffic stops: {e}")
+        return
+    refresh_rollups_for(store.data_version)
+
+
+@st.cache_resource
+def get_ingest_queue():
+    return WriteBehindQueue(on_flush=invalidate_dashboard_caches)
+
+
+# Read a CSV or JSONL file in chunks
+def read_stops_file(path_or_buffer, name=None, chunksize=INGEST_BATCH_SIZE):
+    name = name or str(path_or_buffer)
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return pd.read_json(path_or_buffer, lines=True, chunksize=chunksize, dtype=False)
+    return pd.read_csv(path_or_buffer, chunksize=chunksize, dtype=str, keep_default_na=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load police logs into traffic_stops")
+    parser.add_argument('path', help="CSV or JSONL file of stops")
+    parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    written, rejected = 0, []
+    for chunk in read_stops_file(args.path, chunksize=args.batch_size):
+        rows, bad = validate_stops(chunk)
+        written += copy_stops(rows, args.batch_size)
+        if len(bad):
+            rejected.append(bad)
+    print(f"Loaded {written:,} stops in {time.perf_counter() - started:.1f}s")
+    if rejected:
+        rejected = pd.concat(rejected, ignore_index=True)
+        rejected_path = f"{args.path}.rejected.csv"
+        rejected.to_csv(rejected_path, index=False)
+        print(f"{len(rejected):,} rows rejected, see {rejected_path}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# Server-side paging for the Police Logs Overview.
+# Only the visible window of traffic_stops is fetched; sorting and column
+# filters are pushed down to PostgreSQL as bound parameters. When the table
+# has a row id column, pages are fetched by keyset (sort column, id) so deep
+# pages cost the same as the first one; otherwise LIMIT/OFFSET is used.
+
+import json
+from functools import lru_cache
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import inspect, text
+
+from db import get_engine
+from dataset import ID_COLUMN
+from profiling import timed
+from queries import FILTER_COLUMNS, build_where
+from schema import seconds_to_time
+
+# Columns the viewer may sort on (also guards the ORDER BY against injection)
+SORTABLE_COLUMNS = [
+    'stop_date', 'stop_time', 'country_name', 'driver_gender', 'driver_age', 'driver_race',
+    'violation', 'stop_outcome', 'stop_duration', 'vehicle_number',
+]
+PAGE_SIZES = [100, 250, 500]
+COUNT_ESTIMATE_TTL = 300
+
+
+# Column names of traffic_stops (looked up once per process)
+@lru_cache(maxsize=1)
+def table_columns():
+    return tuple(col['name'] for col in inspect(get_engine()).get_columns('traffic_stops'))
+
+
+# Keyset paging needs a unique tie-breaker column
+def supports_keyset():
+    return ID_COLUMN in table_columns()
+
+
+# Rows strictly after the cursor (last sort value, last id) in the page order.
+# NULL sort values are placed where a plain btree index puts them
+# (last when ascending, first when descending).
+def _keyset_clause(sort_by, descending, cursor, params):
+    last_value, last_id = cursor
+    params['cursor_id'] = last_id
+    id_op = '<' if descending else '>'
+    if last_value is None:
+        if descending:
+            return f"(({sort_by} IS NULL AND {ID_COLUMN} < :cursor_id) OR {sort_by} IS NOT NULL)"
+        return f"({sort_by} IS NULL AND {ID_COLUMN} > :cursor_id)"
+    params['cursor_value'] = last_value
+    op = '<' if descending else '>'
+    clause = f"({sort_by} {op} :cursor_value OR ({sort_by} = :cursor_value AND {ID_COLUMN} {id_op} :cursor_id))"
+    if not descending:
+        clause = f"({clause} OR {sort_by} IS NULL)"
+    return clause
+
+
+def _python_value(value):
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if hasattr(value, 'item') else value
+
+
+# Fetch one page. Keyset mode takes the cursor returned with the previous
+# page; offset mode takes the page number. Returns (rows, next_cursor).
+def fetch_page(filters, sort_by='stop_date', descending=True, page_size=100, cursor=None, page=0):
+    if sort_by not in SORTABLE_COLUMNS:
+        raise ValueError(f"Cannot sort by {sort_by!r}")
+    clauses, params = build_where(filters)
+    keyset = supports_keyset()
+    direction = 'DESC' if descending else 'ASC'
+    order_by = f"{sort_by} {direction}"
+    if keyset:
+        order_by += f", {ID_COLUMN} {direction}"
+        if cursor is not None:
+            clauses.append(_keyset_clause(sort_by, descending, cursor, params))
+
+    sql = "SELECT * FROM traffic_stops"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += f" ORDER BY {order_by} LIMIT :limit"
+    params['limit'] = page_size
+    if not keyset:
+        sql += " OFFSET :offset"
+        params['offset'] = page * page_size
+
+    with timed('overview page', 'sql', sql=sql, params=params) as timing:
+        rows = timing.observe(pd.read_sql(text(sql), get_engine(), params=params))
+    next_cursor = None
+    if keyset and len(rows) == page_size:
+        last = rows.iloc[-1]
+        next_cursor = (_python_value(last[sort_by]), _python_value(last[ID_COLUMN]))
+    return rows, next_cursor
+
+
+# The same page cut from an in-memory frame (offline mode, no database).
+# Returns (rows, matching_row_count).
+def page_frame(data, filters, sort_by='stop_date', descending=True, page_size=100, page=0):
+    if sort_by not in SORTABLE_COLUMNS:
+        raise ValueError(f"Cannot sort by {sort_by!r}")
+    mask = pd.Series(True, index=data.index)
+    for col in FILTER_COLUMNS:
+        if filters.get(col) and col in data.columns:
+            mask &= data[col].isin(filters[col])
+    if filters.get('date_from'):
+        mask &= data['stop_date'] >= pd.Timestamp(filters['date_from'])
+    if filters.get('date_to'):
+        mask &= data['stop_date'] <= pd.Timestamp(filters['date_to'])
+    matching = data[mask]
+    order = matching.sort_values(sort_by, ascending=not descending, kind='stable', na_position='last')
+    rows = order.iloc[page * page_size:(page + 1) * page_size]
+    if 'stop_time' in rows.columns and rows['stop_time'].dtype != object:
+        rows = rows.assign(stop_time=seconds_to_time(rows['stop_time']))
+    return rows, len(matching)
+
+
+# Planner row estimate for the filtered table; cheap compared to COUNT(*)
+@st.cache_data(ttl=COUNT_ESTIMATE_TTL, show_spinner=False)
+def estimate_count(filters_json):
+    filters = json.loads(filters_json)
+    clauses, params = build_where(filters)
+    with get_engine().connect() as conn:
+        if not clauses:
+            estimate = conn.execute(text(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = 'traffic_stops'::regclass"
+            )).scalar()
+            # reltuples is -1 until the table has been analyzed
+            if estimate is not None and estimate >= 0:
+                return int(estimate)
+        sql = "EXPLAIN (FORMAT JSON) SELECT 1 FROM traffic_stops"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        plan = conn.execute(text(sql), params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
@@ -0,0 +1,447 @@
+# Stop outcome / violation prediction.
+# Instead of filtering the whole dataset on every submission, outcome and
+# violation frequencies are precomputed per (gender, age, search, drugs,
+# duration) combination. The PredictionIndex used by the dashboard adds each
+# synced batch's per-combination counts to its frequency tables, subtracting
+# those of replaced rows, and tops up its example stops per combination.
+#
+# Predictions come from a PredictionModel: the most frequent outcome and
+# violation per combination, backing off to coarser combinations (age band,
+# then fewer features, then all stops) when a combination has fewer than
+# MIN_SUPPORT past stops. The model can be saved as a versioned artifact and
+# served without Streamlit:
+#
+#   python prediction.py train                  # from the snapshot, or PostgreSQL
+#   python prediction.py train --from-csv stops.csv
+#   python prediction.py serve --port 8765      # POST /predict, GET /health
+#   python prediction.py predict stops.csv      # score a file, CSV to stdout
+
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+PREDICTION_KEYS = ['driver_gender', 'driver_age', 'search_conducted', 'drugs_related_stop', 'stop_duration']
+PREVIEW_ROWS = 5
+
+# Used only when the model has seen no stops at all
+FALLBACK_OUTCOME = "warning"
+FALLBACK_VIOLATION = "speeding"
+
+MIN_SUPPORT = int(os.environ.get("ENFORCEIQ_PREDICTION_MIN_SUPPORT", "5"))
+AGE_BAND_YEARS = 5
+ARTIFACT_DIR = os.environ.get("ENFORCEIQ_PREDICTION_DIR", os.path.join("artifacts", "prediction"))
+PREDICTION_PORT = int(os.environ.get("ENFORCEIQ_PREDICTION_PORT", "8765"))
+
+# Bump whenever the artifact layout changes
+ARTIFACT_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+
+# Back-off levels, most specific first: name -> key columns
+BACKOFF_LEVELS = {
+    'gender, age, search, drugs, duration': PREDICTION_KEYS,
+    'gender, age band, search, drugs, duration': ['driver_gender', 'age_band', 'search_conducted', 'drugs_related_stop', 'stop_duration'],
+    'gender, age band, search, drugs': ['driver_gender', 'age_band', 'search_conducted', 'drugs_related_stop'],
+    'search, drugs': ['search_conducted', 'drugs_related_stop'],
+    'all stops': [],
+}
+
+
+# Canonical key for one stop (form inputs and dataset rows compare equal)
+def prediction_key(driver_gender, driver_age, search_conducted, drugs_related_stop, stop_duration):
+    return (
+        str(driver_gender),
+        int(driver_age),
+        _as_bool(search_conducted),
+        _as_bool(drugs_related_stop),
+        str(stop_duration),
+    )
+
+
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 't', 'yes', 'y')
+    return bool(value)
+
+
+# Canonical key columns for many stops (vectorized prediction_key) plus the age band
+def prediction_keys(stops):
+    missing = [col for col in PREDICTION_KEYS if col not in stops.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    keys = pd.DataFrame({
+        'driver_gender': stops['driver_gender'].astype(str),
+        'driver_age': pd.to_numeric(stops['driver_age'], errors='coerce').fillna(-1).astype(int),
+        'search_conducted': stops['search_conducted'].map(_as_bool).astype(bool),
+        'drugs_related_stop': stops['drugs_related_stop'].map(_as_bool).astype(bool),
+        'stop_duration': stops['stop_duration'].astype(str),
+    }, index=stops.index)
+    keys['age_band'] = keys['driver_age'] // AGE_BAND_YEARS * AGE_BAND_YEARS
+    return keys
+
+
+def _add_counts(target, counts, sign=1):
+    for (*key, value), count in counts.items():
+        key = prediction_key(*key)
+        counter = target.setdefault(key, Counter())
+        counter[value] += sign * int(count)
+        if counter[value] <= 0:
+            del counter[value]
+        if not counter:
+            del target[key]
+
+
+# Long frame of (key columns..., value, count) from key -> Counter
+def _counts_frame(counters, value):
+    rows = [(*key, v, count) for key, counter in counters.items() for v, count in counter.items()]
+    frame = pd.DataFrame(rows, columns=PREDICTION_KEYS + [value, 'count'])
+    frame['age_band'] = frame['driver_age'] // AGE_BAND_YEARS * AGE_BAND_YEARS
+    return frame
+
+
+# Most frequent value per group of keys with its share and the group size;
+# ties go to the smallest value
+def _mode_table(counts, keys, value):
+    grouped = counts.groupby(keys + [value], sort=False)['count'].sum().reset_index() if keys else (
+        counts.groupby(value, sort=False)['count'].sum().reset_index())
+    totals = grouped.groupby(keys)['count'].transform('sum') if keys else grouped['count'].sum()
+    grouped = grouped.assign(matches=totals, share=grouped['count'] / totals)
+    grouped = grouped.sort_values(['count', value], ascending=[False, True], kind='stable')
+    best = grouped.drop_duplicates(keys) if keys else grouped.head(1)
+    return best[keys + [value, 'matches', 'share']].reset_index(drop=True)
+
+
+class PredictionModel:
+    def __init__(self, tables=None, version=None, trained_rows=0, min_support=MIN_SUPPORT):
+        self.tables = tables or {}  # level name -> frame of keys, predictions, matches, confidences
+        self.version = version
+        self.trained_rows = trained_rows
+        self.min_support = min_support
+        self._lookups = {}  # level name -> {key tuple: prediction row}, built on first single-stop prediction
+
+    # Build from long count frames (key columns, age_band, value, count)
+    @classmethod
+    def from_counts(cls, outcome_counts, violation_counts, **kwargs):
+        tables = {}
+        for level, keys in BACKOFF_LEVELS.items():
+            outcomes = _mode_table(outcome_counts, keys, 'stop_outcome').rename(columns={
+                'stop_outcome': 'predicted_outcome', 'share': 'outcome_confidence'})
+            violations = _mode_table(violation_counts, keys, 'violation').rename(columns={
+                'violation': 'predicted_violation', 'share': 'violation_confidence'}).drop(columns='matches')
+            tables[level] = outcomes.merge(violations, on=keys, how='left') if keys else pd.concat([outcomes, violations], axis=1)
+        return cls(tables, trained_rows=int(outcome_counts['count'].sum()), **kwargs)
+
+    # Train on cleaned stops
+    @classmethod
+    def from_data(cls, data, **kwargs):
+        keys = prediction_keys(data)
+        counts = {}
+        for value in ('stop_outcome', 'violation'):
+            frame = keys.assign(**{value: data[value].astype(str)})
+            counts[value] = frame.groupby(list(frame.columns), sort=False).size().reset_index(name='count')
+        return cls.from_counts(counts['stop_outcome'], counts['violation'], **kwargs)
+
+    # Score many stops at once; stops must have the PREDICTION_KEYS columns.
+    # Adds matches (past stops with the same details), the predictions,
+    # their confidence (share of matching stops) and the back-off level used.
+    def predict_batch(self, stops):
+        keys = prediction_keys(stops)
+        columns = ['predicted_outcome', 'outcome_confidence', 'predicted_violation', 'violation_confidence']
+        scored = pd.DataFrame(index=stops.index, columns=columns + ['basis'], dtype=object)
+        matches = pd.Series(0, index=stops.index)
+        pending = pd.Series(True, index=stops.index)
+        for i, (level, level_keys) in enumerate(self.tables_by_level()):
+            table = self.tables[level]
+            if table.empty:
+                continue
+            if level_keys:
+                found = keys[level_keys].merge(table, on=level_keys, how='left').set_index(stops.index)
+            else:
+                found = pd.DataFrame([table.iloc[0].to_dict()] * len(stops), index=stops.index)
+            if i == 0:
+                matches = found['matches'].fillna(0).astype(int)
+            last = i == len(self.tables) - 1
+            use = pending & found['matches'].notna() & ((found['matches'] >= self.min_support) | last)
+            scored.loc[use, columns] = found.loc[use, columns].to_numpy()
+            scored.loc[use, 'basis'] = level
+            pending &= ~use
+        result = stops.copy()
+        result['matches'] = matches
+        result['predicted_outcome'] = scored['predicted_outcome'].fillna(FALLBACK_OUTCOME)
+        result['predicted_violation'] = scored['predicted_violation'].fillna(FALLBACK_VIOLATION)
+        result['outcome_confidence'] = pd.to_numeric(scored['outcome_confidence']).fillna(0.0)
+        result['violation_confidence'] = pd.to_numeric(scored['violation_confidence']).fillna(0.0)
+        result['basis'] = scored['basis'].fillna('fallback')
+        return result
+
+    # Score one stop with dictionary lookups instead of merges (the form's path)
+    def predict(self, driver_gender, driver_age, search_conducted, drugs_related_stop, stop_duration):
+        stop = dict(zip(PREDICTION_KEYS, prediction_key(driver_gender, driver_age, search_conducted, drugs_related_stop, stop_duration)))
+        stop['age_band'] = stop['driver_age'] // AGE_BAND_YEARS * AGE_BAND_YEARS
+        levels = self.tables_by_level()
+        matches = 0
+        for i, (level, level_keys) in enumerate(levels):
+            row = self._lookup(level).get(tuple(stop[col] for col in level_keys))
+            if row is None:
+                continue
+            if i == 0:
+                matches = int(row['matches'])
+            if row['matches'] >= self.min_support or i == len(levels) - 1:
+                return {
+                    'matches': matches,
+                    'outcome': row['predicted_outcome'],
+                    'violation': row['predicted_violation'],
+                    'outcome_confidence': float(row['outcome_confidence']),
+                    'violation_confidence': float(row['violation_confidence']),
+                    'basis': level,
+                }
+        return {
+            'matches': matches, 'outcome': FALLBACK_OUTCOME, 'violation': FALLBACK_VIOLATION,
+            'outcome_confidence': 0.0, 'violation_confidence': 0.0, 'basis': 'fallback',
+        }
+
+    def _lookup(self, level):
+        if level not in self._lookups:
+            keys = BACKOFF_LEVELS[level]
+            self._lookups[level] = {
+                tuple(row[col] for col in keys): row for row in self.tables[level].to_dict(orient='records')
+            }
+        return self._lookups[level]
+
+    def tables_by_level(self):
+        return [(level, BACKOFF_LEVELS[level]) for level in BACKOFF_LEVELS if level in self.tables]
+
+    # Write the model as the next artifact version in path; returns the manifest
+    def save(self, path=ARTIFACT_DIR):
+        previous = read_artifact_manifest(path)
+        version = previous['version'] + 1 if previous else 1
+        os.makedirs(path, exist_ok=True)
+        name = f"prediction-v{version}.parquet"
+        frames = [table.assign(level=level) for level, table in self.tables.items()]
+        pd.concat(frames, ignore_index=True).to_parquet(os.path.join(path, name), index=False)
+        manifest = {
+            'format': ARTIFACT_FORMAT,
+            'version': version,
+            'file': name,
+            'created_at': time.time(),
+            'trained_rows': self.trained_rows,
+            'min_support': self.min_support,
+            'levels': list(self.tables),
+        }
+        tmp_manifest = os.path.join(path, f".{MANIFEST_FILE}.tmp-{os.getpid()}")
+        with open(tmp_manifest, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_manifest, os.path.join(path, MANIFEST_FILE))
+        self.version = version
+        return manifest
+
+    @classmethod
+    def load(cls, path=ARTIFACT_DIR):
+        manifest = read_artifact_manifest(path)
+        if manifest is None:
+            raise FileNotFoundError(f"No prediction artifact in {path} (train one with: python prediction.py train)")
+        if manifest['format'] != ARTIFACT_FORMAT:
+            raise ValueError(f"Prediction artifact format {manifest['format']} does not match {ARTIFACT_FORMAT}")
+        frame = pd.read_parquet(os.path.join(path, manifest['file']))
+        tables = {}
+        for level in manifest['levels']:
+            keys = BACKOFF_LEVELS[level]
+            table = frame[frame['level'] == level].drop(columns='level')
+            tables[level] = table[keys + [col for col in table.columns if col not in PREDICTION_KEYS + ['age_band']]].reset_index(drop=True)
+        return cls(tables, manifest['version'], manifest['trained_rows'], manifest['min_support'])
+
+
+def read_artifact_manifest(path=ARTIFACT_DIR):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class PredictionIndex:
+    def __init__(self):
+        self.outcomes = {}    # key -> Counter of stop_outcome
+        self.violations = {}  # key -> Counter of violation
+        self.preview = None   # up to PREVIEW_ROWS example stops per key
+        self._preview_rows_by_key = {}
+        self._model = None
+
+    def build(self, data):
+        self.outcomes, self.violations, self.preview = {}, {}, None
+        self.update(data)
+
+    # Fold a batch of new stops into the index (and take out replaced ones)
+    def update(self, delta, removed=None):
+        if delta is not None and len(delta):
+            _add_counts(self.outcomes, delta.groupby(PREDICTION_KEYS + ['stop_outcome'], observed=True).size())
+            _add_counts(self.violations, delta.groupby(PREDICTION_KEYS + ['violation'], observed=True).size())
+            examples = delta.groupby(PREDICTION_KEYS, observed=True).head(PREVIEW_ROWS)
+            preview = examples if self.preview is None else pd.concat([self.preview, examples])
+            self.preview = preview.groupby(PREDICTION_KEYS, observed=True).head(PREVIEW_ROWS)
+            self._preview_rows_by_key = {
+                prediction_key(*key): rows
+                for key, rows in self.preview.groupby(PREDICTION_KEYS, observed=True).indices.items()
+            }
+        if removed is not None and len(removed):
+            _add_counts(self.outcomes, removed.groupby(PREDICTION_KEYS + ['stop_outcome'], observed=True).size(), sign=-1)
+            _add_counts(self.violations, removed.groupby(PREDICTION_KEYS + ['violation'], observed=True).size(), sign=-1)
+        self._model = None
+
+    # Back-off model over the current counts (rebuilt after each update)
+    def model(self):
+        if self._model is None:
+            self._model = PredictionModel.from_counts(
+                _counts_frame(self.outcomes, 'stop_outcome'), _counts_frame(self.violations, 'violation'))
+        return self._model
+
+    # Prediction for one stop: number of matching past stops, most common
+    # outcome and violation (backing off to similar stops when there are too
+    # few matches), the level used and a few example rows
+    def predict(self, driver_gender, driver_age, search_conducted, drugs_related_stop, stop_duration):
+        key = prediction_key(driver_gender, driver_age, search_conducted, drugs_related_stop, stop_duration)
+        prediction = self.model().predict(*key)
+        prediction['preview'] = self._preview_rows(key)
+        return prediction
+
+    def _preview_rows(self, key):
+        rows = self._preview_rows_by_key.get(key)
+        if rows is None:
+            return pd.DataFrame()
+        return self.preview.iloc[rows]
+
+    # Score many stops at once; stops must have the PREDICTION_KEYS columns
+    def predict_batch(self, stops):
+        return self.model().predict_batch(stops)
+
+
+_models = {}  # artifact directory -> loaded PredictionModel
+_model_lock = threading.Lock()
+
+
+# Artifact model in path for this process, loaded on first use and reloaded
+# when a newer version is saved
+def get_model(path=ARTIFACT_DIR):
+    manifest = read_artifact_manifest(path)
+    with _model_lock:
+        model = _models.get(path)
+        if model is None or (manifest and manifest['version'] != model.version):
+            model = _models[path] = PredictionModel.load(path)
+        return model
+
+
+# Local HTTP endpoint:
+#   POST /predict   body: CSV (Content-Type: text/csv) or a JSON list of stops
+#                   (or {"stops": [...]}); returns JSON records
+#   GET  /health    artifact version and training size
+# The artifact directory is the server's artifact_path (see serve). Every
+# error is answered with a JSON body: 400 for a bad request, 503 when there
+# is no usable artifact, 500 otherwise.
+class PredictionHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/health':
+            return self._send(404, {'error': 'not found'})
+        try:
+            model = get_model(self.server.artifact_path)
+        except (FileNotFoundError, ValueError) as e:
+            return self._send(503, {'error': str(e)})
+        except Exception as e:
+            return self._send(500, {'error': f"{type(e).__name__}: {e}"})
+        self._send(200, {'status': 'ok', 'version': model.version, 'trained_rows': model.trained_rows})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            return self._send(404, {'error': 'not found'})
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            if self.headers.get('Content-Type', '').startswith('text/csv'):
+                stops = pd.read_csv(io.BytesIO(body))
+            else:
+                payload = json.loads(body or b'[]')
+                stops = pd.DataFrame(payload['stops'] if isinstance(payload, dict) else payload)
+        except (ValueError, KeyError, TypeError, pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+            return self._send(400, {'error': str(e)})
+        try:
+            model = get_model(self.server.artifact_path)
+        except (FileNotFoundError, ValueError) as e:
+            return self._send(503, {'error': str(e)})
+        except Exception as e:
+            return self._send(500, {'error': f"{type(e).__name__}: {e}"})
+        try:
+            scored = model.predict_batch(stops)
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+        except Exception as e:
+            return self._send(500, {'error': f"{type(e).__name__}: {e}"})
+        self._send(200, scored.to_json(orient='records'))
+
+    # payload: JSON-serialisable object or an already encoded JSON string
+    def _send(self, status, payload):
+        body = (payload if isinstance(payload, str) else json.dumps(payload)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=PREDICTION_PORT, host='127.0.0.1', path=ARTIFACT_DIR):
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.artifact_path = path
+    print(f"Serving predictions from {path} on http://{host}:{port}/predict", flush=True)
+    server.serve_forever()
+
+
+# Cleaned stops to train on: a CSV export, else the snapshot, else PostgreSQL
+def _training_data(from_csv=None):
+    from dataset import CHUNK_SIZE, TrafficStopsStore, restore_snapshot
+
+    store = TrafficStopsStore()
+    if from_csv:
+        age_median = pd.read_csv(from_csv, usecols=['driver_age'])['driver_age'].median()
+        store.load_chunks(pd.read_csv(from_csv, chunksize=CHUNK_SIZE), None if pd.isna(age_median) else float(age_median), source=from_csv)
+    elif not restore_snapshot(store):
+        store.load()
+    return store.data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train, serve or run the stop outcome prediction model")
+    parser.add_argument('command', choices=['train', 'serve', 'predict'])
+    parser.add_argument('file', nargs='?', help="CSV of stops to score (predict)")
+    parser.add_argument('--from-csv', help="train on this CSV of raw stops instead of the snapshot/PostgreSQL")
+    parser.add_argument('--path', default=ARTIFACT_DIR, help="Artifact directory")
+    parser.add_argument('--port', type=int, default=PREDICTION_PORT)
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args(argv)
+
+    if args.command == 'train':
+        started = time.perf_counter()
+        model = PredictionModel.from_data(_training_data(args.from_csv))
+        manifest = model.save(args.path)
+        print(f"Saved prediction model v{manifest['version']} ({manifest['trained_rows']:,} stops) "
+              f"to {args.path} in {time.perf_counter() - started:.1f}s")
+        return 0
+
+    if args.command == 'serve':
+        serve(args.port, args.host, args.path)
+        return 0
+
+    if not args.file:
+        parser.error("predict needs a CSV file")
+    get_model(args.path).predict_batch(pd.read_csv(args.file)).to_csv(sys.stdout, index=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# Timing of database calls and expensive pandas stages.
+# Every call is recorded under a name (a canned query title, "clean_data",
+# a chart, ...) with its wall time, rows and result size. The last
+# TIMING_WINDOW samples per name feed the p50/p95/p99 admin panel, and calls
+# slower than SLOW_QUERY_MS (or failing) are appended to a JSON-lines
+# slow-query log that survives restarts.
+
+import datetime
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+SLOW_QUERY_MS = float(os.environ.get("ENFORCEIQ_SLOW_QUERY_MS", "500"))
+SLOW_QUERY_LOG = os.environ.get("ENFORCEIQ_SLOW_QUERY_LOG", os.path.join("logs", "slow_queries.jsonl"))
+# Attach an EXPLAIN (ANALYZE, BUFFERS) plan to slow SQL entries. ANALYZE runs
+# the query a second time, so this is off by default.
+EXPLAIN_SLOW = os.environ.get("ENFORCEIQ_EXPLAIN_SLOW", "0") != "0"
+TIMING_WINDOW = int(os.environ.get("ENFORCEIQ_TIMING_WINDOW", "1000"))
+
+
+# Short label for SQL that has no name of its own
+def query_label(sql, width=60):
+    label = ' '.join(str(sql).split())
+    return label if len(label) <= width else label[:width - 3] + '...'
+
+
+# Measurements of one call, filled in by the code being timed
+class Timing:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.rows = None
+        self.nbytes = None
+        self.plan = None
+
+    # Rows and in-memory size of the frame the call produced (the size is a
+    # proxy for the bytes transferred from the database)
+    def observe(self, frame):
+        self.rows = len(frame)
+        self.nbytes = int(frame.memory_usage(deep=True).sum())
+        return frame
+
+    # Stop the clock (later work, such as fetching a plan, is not counted)
+    def stop(self):
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.started
+        return self.seconds
+
+
+class QueryTimings:
+    def __init__(self, window=TIMING_WINDOW, slow_ms=SLOW_QUERY_MS, log_path=SLOW_QUERY_LOG):
+        self.window = window
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self.slow = 0
+        self._samples = {}  # (name, kind) -> deque of (ms, rows, nbytes, failed)
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+
+    def record(self, name, kind, seconds, rows=None, nbytes=None, sql=None, params=None, plan=None, error=None):
+        ms = seconds * 1000
+        with self._lock:
+            samples = self._samples.get((name, kind))
+            if samples is None:
+                samples = self._samples[(name, kind)] = deque(maxlen=self.window)
+            samples.append((ms, rows, nbytes, error is not None))
+        if ms >= self.slow_ms or error is not None:
+            self._log({
+                'at': datetime.datetime.now().isoformat(timespec='seconds'),
+                'name': name,
+                'kind': kind,
+                'ms': round(ms, 1),
+                'rows': rows,
+                'bytes': nbytes,
+                'sql': None if sql is None else ' '.join(str(sql).split()),
+                'params': None if not params else {k: str(v) for k, v in params.items()},
+                'error': error,
+                'plan': plan,
+            })
+
+    def _log(self, entry):
+        with self._log_lock:
+            self.slow += 1
+            if not self.log_path:
+                return
+            try:
+                folder = os.path.dirname(self.log_path)
+                if folder:
+                    os.makedirs(folder, exist_ok=True)
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, default=str) + '\n')
+            except OSError as e:
+                print(f"Error writing slow-query log: {e}")
+
+    # Latency percentiles per name over the recorded window
+    def summary(self):
+        with self._lock:
+            samples = {key: list(values) for key, values in self._samples.items()}
+        rows = []
+        for (name, kind), values in samples.items():
+            ms = np.array([v[0] for v in values])
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            result_rows = [v[1] for v in values if v[1] is not None]
+            result_bytes = [v[2] for v in values if v[2] is not None]
+            rows.append({
+                'name': name,
+                'kind': kind,
+                'calls': len(values),
+                'errors': sum(v[3] for v in values),
+                'p50_ms': p50,
+                'p95_ms': p95,
+                'p99_ms': p99,
+                'max_ms': ms.max(),
+                'avg_rows': np.mean(result_rows) if result_rows else None,
+                'avg_kb': np.mean(result_bytes) / 1024 if result_bytes else None,
+            })
+        columns = ['name', 'kind', 'calls', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'avg_rows', 'avg_kb']
+        return pd.DataFrame(rows, columns=columns).sort_values('p95_ms', ascending=False, ignore_index=True)
+
+    # Most recent entries of the slow-query log, newest first
+    def slow_entries(self, limit=50):
+        try:
+            with open(self.log_path, encoding='utf-8') as f:
+                lines = deque(f, maxlen=limit)
+        except (OSError, TypeError):
+            return []
+        entries = []
+        for line in reversed(lines):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
+
+    # Forget the in-memory samples (the slow-query log is kept)
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+_timings = QueryTimings()
+
+
+def get_timings():
+    return _timings
+
+
+# Time the enclosed block and record it under name:
+#     with timed('clean_data') as timing:
+#         df = timing.observe(clean_data(raw))
+@contextmanager
+def timed(name, kind='pandas', sql=None, params=None):
+    timing = Timing()
+    error = None
+    try:
+        yield timing
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _timings.record(
+            name, kind, timing.stop(), rows=timing.rows, nbytes=timing.nbytes,
+            sql=sql, params=params, plan=timing.plan, error=error,
+        )
@@ -0,0 +1,419 @@
+# Canned SQL queries offered in the dashboard's query selectors.
+# Each query is written once as a template in portable SQL; the few
+# constructs that differ between databases are written as @macro(...) calls
+# (see MACROS) and expanded for the target dialect by render_sql. The
+# PostgreSQL versions are available as MEDIUM_QUERIES / COMPLEX_QUERIES.
+#
+# Thresholds and limits are bound parameters (:top_n, :young_age, ... see
+# QUERY_PARAMETERS), and build_query can push date, country, violation, age
+# and time-of-day filters down into every read of traffic_stops.
+
+import re
+
+DIALECTS = ('postgresql', 'duckdb', 'sqlite')
+
+_MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+                'August', 'September', 'October', 'November', 'December']
+
+
+# time BETWEEN start AND end, where a window with start > end wraps past midnight
+def _time_window(cast):
+    t, start, end = '{0}', cast.format('{1}'), cast.format('{2}')
+    return (f"(case when {start} <= {end} then {t} between {start} and {end} "
+            f"else ({t} >= {start} or {t} <= {end}) end)")
+
+
+# macro -> dialect -> SQL with {0}, {1}, ... for the macro arguments
+MACROS = {
+    'year': {
+        'postgresql': "extract(year from {0})",
+        'duckdb': "extract(year from {0})",
+        'sqlite': "cast(strftime('%Y', {0}) as integer)",
+    },
+    'month': {
+        'postgresql': "extract(month from {0})",
+        'duckdb': "extract(month from {0})",
+        'sqlite': "cast(strftime('%m', {0}) as integer)",
+    },
+    'hour': {
+        'postgresql': "extract(hour from {0})",
+        'duckdb': "extract(hour from {0})",
+        'sqlite': "cast(strftime('%H', {0}) as integer)",
+    },
+    # Blank-padded to 9 characters like PostgreSQL's to_char(..., 'Month')
+    'month_name': {
+        'postgresql': "to_char({0}, 'Month')",
+        'duckdb': "rpad(strftime({0}, '%B'), 9, ' ')",
+        'sqlite': "case cast(strftime('%m', {0}) as integer) "
+                  + ' '.join(f"when {i} then '{name:<9}'" for i, name in enumerate(_MONTH_NAMES, 1))
+                  + " end",
+    },
+    # Exact (non-integer) division of counts
+    'numeric': {
+        'postgresql': "cast({0} as numeric)",
+        'duckdb': "cast({0} as double)",
+        'sqlite': "cast({0} as real)",
+    },
+    # An 'HH:MM:SS' string (SQLite compares times as text)
+    'time': {
+        'postgresql': "cast({0} as time)",
+        'duckdb': "cast({0} as time)",
+        'sqlite': "{0}",
+    },
+    # @time_window(column, start, end)
+    'time_window': {
+        'postgresql': _time_window("cast({} as time)"),
+        'duckdb': _time_window("cast({} as time)"),
+        'sqlite': _time_window("{}"),
+    },
+}
+
+_MACRO_CALL = re.compile(r"@(\w+)\(")
+_QUOTED = re.compile(r"('(?:[^']|'')*')")
+_BIND_PARAM = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+# Reads of the table, optionally aliased ("from traffic_stops as t")
+_TABLE_READ = re.compile(r"\b(from|join)(\s+)traffic_stops\b(\s+as\s+(\w+))?", re.IGNORECASE)
+
+
+# Split macro arguments on commas outside parentheses
+def _split_arguments(text):
+    args, depth, start = [], 0, 0
+    for i, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            args.append(text[start:i].strip())
+            start = i + 1
+    args.append(text[start:].strip())
+    return args
+
+
+# Expand the @macro(...) calls of a query template for dialect
+def render_sql(template, dialect='postgresql'):
+    if dialect not in DIALECTS:
+        raise ValueError(f"Unknown SQL dialect: {dialect}")
+    parts, pos = [], 0
+    while True:
+        match = _MACRO_CALL.search(template, pos)
+        if match is None:
+            parts.append(template[pos:])
+            return ''.join(parts)
+        # The arguments run to the matching closing parenthesis
+        depth, end = 1, match.end()
+        while depth:
+            if end >= len(template):
+                raise ValueError(f"Unbalanced @{match.group(1)}( in query template")
+            depth += {'(': 1, ')': -1}.get(template[end], 0)
+            end += 1
+        arguments = [render_sql(arg, dialect) for arg in _split_arguments(template[match.end():end - 1])]
+        parts.append(template[pos:match.start()])
+        parts.append(MACROS[match.group(1)][dialect].format(*arguments))
+        pos = end
+
+
+def render_queries(templates, dialect='postgresql'):
+    return {name: render_sql(template, dialect) for name, template in templates.items()}
+
+
+# Tunable thresholds of the canned queries: name -> (label, default)
+QUERY_PARAMETERS = {
+    'row_limit': ("Rows to show", 10),
+    'top_n': ("Top results", 1),
+    'young_age': ("Younger than (age)", 25),
+    'night_start': ("Night starts at", '22:00:00'),
+    'night_end': ("Night ends at", '05:00:00'),
+}
+
+# Columns that can be filtered with a list of allowed values
+FILTER_COLUMNS = ['country_name', 'violation', 'driver_gender', 'driver_race', 'stop_outcome', 'stop_duration']
+
+
+# WHERE clauses and bound parameters for the selected filters.
+# filters maps a column in FILTER_COLUMNS to the list of allowed values;
+# 'date_from'/'date_to' bound stop_date, 'age_min'/'age_max' driver_age and
+# 'time_from'/'time_to' ('HH:MM:SS', may wrap past midnight) stop_time.
+def build_where(filters, dialect='postgresql'):
+    clauses, params = [], {}
+    for col in FILTER_COLUMNS:
+        values = filters.get(col)
+        if not values:
+            continue
+        names = []
+        for i, value in enumerate(values):
+            names.append(f":{col}_{i}")
+            params[f"{col}_{i}"] = value
+        clauses.append(f"{col} IN ({', '.join(names)})")
+    for key, clause in (
+        ('date_from', "stop_date >= :date_from"),
+        ('date_to', "stop_date <= :date_to"),
+        ('age_min', "driver_age >= :age_min"),
+        ('age_max', "driver_age <= :age_max"),
+    ):
+        if filters.get(key) is not None and filters.get(key) != '':
+            clauses.append(clause)
+            params[key] = filters[key]
+    if filters.get('time_from') and filters.get('time_to'):
+        clauses.append(render_sql("@time_window(stop_time, :time_from, :time_to)", dialect))
+        params['time_from'] = str(filters['time_from'])
+        params['time_to'] = str(filters['time_to'])
+    return clauses, params
+
+
+# Replace every read of traffic_stops with a filtered derived table, so the
+# predicates apply before grouping and joining (PostgreSQL inlines the
+# subquery and can use indexes on the filtered columns)
+def push_down(sql, clauses):
+    if not clauses:
+        return sql
+    where = " AND ".join(clauses)
+
+    def filtered(match):
+        alias = match.group(4) or 'traffic_stops'
+        return f"{match.group(1)}{match.group(2)}(select * from traffic_stops where {where}) as {alias}"
+
+    return _TABLE_READ.sub(filtered, sql)
+
+
+# Named parameters of a SQL string (string literals are skipped)
+def bind_names(sql):
+    parts = _QUOTED.split(sql)
+    return {name for part in parts[::2] for name in _BIND_PARAM.findall(part)}
+
+
+# DuckDB's Python API binds $name instead of :name
+def _duckdb_params(sql):
+    parts = _QUOTED.split(sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = _BIND_PARAM.sub(r"$\1", parts[i])
+    return ''.join(parts)
+
+
+# Medium queries
+MEDIUM_TEMPLATES = {
+    "1. 🚘 Vehicle_Number involved in drug-related stops":"select vehicle_number, drugs_related_stop  from traffic_stops where drugs_related_stop = true limit :row_limit",
+    
+    "2. Most frequently searched vechicles":"select vehicle_number, count(*) as search_count from traffic_stops where search_conducted = true group by vehicle_number order by search_count desc limit :top_n",
+    
+    "3. Which driver age group had the highest arrest rate?": """
+    select 
+     case
+    when driver_age < 18 then 'under18'
+    when driver_age <= 25 then '18-25'
+    when driver_age <= 35 then '26-35'
+    when driver_age <= 50 then '36-50'
+    when driver_age <= 65 then '51-65'
+    else '65+'
+  end as Age_group,
+  driver_age, avg(case when is_arrested=true then 1 else 0 end) as rate_of_arrest
+ from traffic_stops 
+ group by driver_age 
+ order by rate_of_arrest desc limit :top_n""",
+   
+    "4. Gender distribution of drivers stopped in each country": """select country_name,driver_gender,count(*) as stop_counts from traffic_stops where search_conducted = true
+group by country_name, driver_gender order by country_name, stop_counts desc""",
+    
+    "5. Which race and gender combination has the highest search rate ?": """select driver_gender,driver_race,count(*) as stop_counts from traffic_stops where search_conducted=true group by driver_gender,driver_race
+order by stop_counts desc limit :top_n""",
+   
+    "6. What time of day sees the most traffic stops?": """select 
+ case 
+  when @hour(stop_time) between 5 and 11 then 'Morning' 
+  when @hour(stop_time) between 12 and 16 then 'Noon'
+  when @hour(stop_time) between 17 and 20 then 'Evening'
+  else 'Night'
+end as time_of_day,
+count(*) as stop_counts from traffic_stops where stop_time is not null group by time_of_day order by stop_counts desc limit :top_n;
+""",
+    
+    "7. Average stop duration for different violations?":"""select violation,avg( case stop_duration
+      when '0-15 Min' then 7.5
+      when '16-30 Min' then 23
+      when '30+ Min' then 35
+    end
+  ) as avg_stop_duration_min from traffic_stops where stop_duration is not null group by violation order by avg_stop_duration_min desc""",
+    
+    "8. Are stops during the night more likely to lead to arrests?": """select case when @time_window(stop_time, :night_start, :night_end) then 'Night' else 'Day'
+end as time_of_day,(@numeric(sum(case when stop_outcome = 'Arrest' then 1 else 0 end)) / count(*)) * 100 as arrest_percentage
+from traffic_stops group by time_of_day order by time_of_day""",
+   
+    "9. Which violations are most associated with searches or arrests?": """select violation,count(*) as stop_counts,
+(@numeric(sum(case when search_conducted=true or stop_outcome='Arrest' then 1 else 0 end)) / count(*)) * 100 as search_or_arrest_percent
+from traffic_stops group by violation order by search_or_arrest_percent desc""",
+
+    "10. Violations that are most common among younger drivers <25": "select violation,count(*) as common_violation_count from traffic_stops where driver_age < :young_age group by violation order by common_violation_count",
+
+    "11. A violation that rarely results in search or arrest": """select violation,count(*) as stop_counts,
+(@numeric(sum(case when search_conducted=true or stop_outcome='Arrest' then 1 else 0 end)) / count(*)) * 100 as search_or_arrest_percent
+from traffic_stops group by violation order by search_or_arrest_percent asc limit :top_n""",
+    
+    "12. Which countries report the highest rate of drug-related stops?":"""select country_name,count(*) as stop_counts from traffic_stops where drugs_related_stop= true
+group by country_name order by stop_counts desc""",
+    
+    "13. The arrest rate by country and violation": """select country_name,violation, @numeric(sum(case when stop_outcome='Arrest' then 1 else 0 end)) / count(*) * 100 as arrest_percentage
+from traffic_stops group by violation,country_name order by arrest_percentage desc""",
+   
+    "14. Which country has the most stops with search conducted?":"""select country_name,count(*) as stop_counts from traffic_stops where search_conducted=true
+group by country_name order by stop_counts desc limit :top_n"""
+}
+
+# Complex queries (joins, subqueries, window functions)
+COMPLEX_TEMPLATES ={
+ 
+    "1. Yearly Breakdown of Stops and Arrests by Country": """SELECT
+    stop_year,
+    country_name,
+    total_stops,
+    total_arrests,
+    -- Calculate the percentage of stops that resulted in an arrest for each country per year
+    (@numeric(total_arrests) * 100 / total_stops) AS arrest_rate_percent_yearly,
+    -- Calculate a running total of stops per year, ordered by country name
+    SUM(total_stops) OVER (PARTITION BY country_name ORDER BY stop_year) AS running_total_stops_per_year,
+	SUM(total_arrests) OVER (PARTITION BY country_name ORDER BY stop_year) AS running_total_arrests_per_year
+FROM
+    (
+        -- Subquery to get base yearly and country aggregates
+        SELECT
+            @year(stop_date) AS stop_year,
+            country_name,
+            COUNT(*) AS total_stops,
+            SUM(CASE WHEN is_arrested = TRUE THEN 1 ELSE 0 END) AS total_arrests
+        FROM
+            traffic_stops
+        WHERE
+            stop_date IS NOT NULL
+        
+        GROUP BY
+            stop_year,
+            country_name
+    ) AS yearly_country_summary -- Alias for the subquery
+ORDER BY
+    stop_year ASC,
+    country_name ASC;
+""",
+    
+    "2. Driver Violation Trends Based on Age and Race":"""select
+    t.driver_age,
+    t.driver_race,
+    t.violation,
+    count(*) as violation_count,
+    (@numeric(count(*)) * 100 / age_race_totals.total_stops_for_group) as percentage_of_group_stops
+from
+    traffic_stops as t
+join (
+    select
+        driver_age,
+        driver_race,
+        count(*) as total_stops_for_group
+    from
+        traffic_stops
+    where
+        driver_age is not null
+        and driver_race is not null
+    group by
+        driver_age,
+        driver_race
+) as age_race_totals
+on
+    t.driver_age = age_race_totals.driver_age
+    and t.driver_race = age_race_totals.driver_race
+where
+    t.driver_age is not null
+    and t.driver_race is not null
+    and t.violation is not null
+group by
+    t.driver_age,
+    t.driver_race,
+    t.violation,
+    age_race_totals.total_stops_for_group
+order by
+    t.driver_age asc,
+    t.driver_race asc,
+    percentage_of_group_stops desc""",
+    
+    "3. Time Period Analysis of Stops & Number of Stops by Year,Month, Hour of the Day":""" select 
+    @year(stop_date) as stop_year,
+    @month_name(stop_date) as stop_month_name,
+    @month(stop_date) as stop_month,
+    @hour(stop_time) as stop_hour,
+    count(*) as total_stops
+from 
+    traffic_stops
+where 
+    stop_date is not null and stop_time is not null
+group by 
+    stop_year, stop_month_name, stop_month, stop_hour
+order by 
+    stop_year, stop_month, stop_hour""",
+
+"4. Violations with High Search and Arrest Rates": """select
+    violation,
+    total_stops,
+    stops_with_search,
+    percentage_searched,
+    stops_with_arrest,
+    percentage_arrested,
+    dense_rank() over (order by percentage_searched desc) as search_rate_rank,
+    dense_rank() over (order by percentage_arrested desc) as arrest_rate_rank
+from
+    (
+        select
+            violation,
+            count(*) as total_stops,
+            count(*) filter (where search_conducted = true) as stops_with_search,
+            (@numeric(count(*) filter (where search_conducted = true)) * 100 / count(*)) as percentage_searched,
+            count(*) filter (where is_arrested = true) as stops_with_arrest,
+            (@numeric(count(*) filter (where is_arrested = true)) * 100 / count(*)) as percentage_arrested
+        from
+            traffic_stops
+        where
+            violation is not null
+        group by
+            violation
+    ) as violation_stats
+where
+    total_stops > 0
+order by
+    percentage_searched desc,
+    percentage_arrested desc;""",
+    
+    "5. Driver Demographics by Country (Age, Gender and Race)": """select country_name,driver_age,driver_gender,driver_race,count(*)as stop_counts from traffic_stops
+group by country_name,driver_age,driver_gender,driver_race order by country_name, stop_counts desc""",
+    
+    "6. Top 5 Violations with Highest Arrest Rates": """select violation, @numeric(sum(case when stop_outcome='Arrest' then 1 else 0 end)) / count(*) * 100 as arrest_percentage
+from traffic_stops group by violation order by arrest_percentage desc""" }
+
+QUERY_TEMPLATES = {**MEDIUM_TEMPLATES, **COMPLEX_TEMPLATES}
+
+# Whole-table aggregations (scans rather than lookups); these are the
+# queries worth handing to a columnar engine such as DuckDB
+ANALYTICAL_QUERIES = frozenset(name for name in QUERY_TEMPLATES if 'group by' in QUERY_TEMPLATES[name].lower())
+
+# PostgreSQL text of every canned query
+MEDIUM_QUERIES = render_queries(MEDIUM_TEMPLATES)
+COMPLEX_QUERIES = render_queries(COMPLEX_TEMPLATES)
+
+
+# A canned query by name, rendered for dialect
+def render_query(name, dialect='postgresql'):
+    return render_sql(QUERY_TEMPLATES[name], dialect)
+
+
+# Tunable parameters a canned query takes, in QUERY_PARAMETERS order
+def query_parameters(name):
+    used = bind_names(QUERY_TEMPLATES[name])
+    return [key for key in QUERY_PARAMETERS if key in used]
+
+
+# SQL and bound parameters for a canned query in dialect, with filters pushed
+# down and params overriding the QUERY_PARAMETERS defaults.
+# Returns (sql, params).
+def build_query(name, dialect='postgresql', filters=None, params=None):
+    clauses, bound = build_where(filters or {}, dialect)
+    sql = push_down(render_query(name, dialect), clauses)
+    for key in query_parameters(name):
+        bound[key] = (params or {}).get(key, QUERY_PARAMETERS[key][1])
+    if dialect == 'duckdb':
+        sql = _duckdb_params(sql)
+    return sql, bound
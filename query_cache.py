@@ -0,0 +1,166 @@
+# Process-wide cache of query results for the canned dashboard queries.
+# Entries are keyed by the engine that answers them (PostgreSQL or the
+# embedded DuckDB), normalized SQL text, bound parameters and the data
+# watermark, expire after a TTL and are evicted least-recently-used once the
+# entry or byte budget is exceeded. A new watermark (new stops ingested)
+# clears the cache.
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import streamlit as st
+
+from db import run_query
+from tasks import QueryCancelled
+
+RESULT_CACHE_TTL = int(os.environ.get("ENFORCEIQ_RESULT_CACHE_TTL", "600"))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("ENFORCEIQ_RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_MAX_MB = int(os.environ.get("ENFORCEIQ_RESULT_CACHE_MAX_MB", "256"))
+
+_QUOTED = re.compile(r"('(?:[^']|'')*')")
+_LINE_COMMENT = re.compile(r"--[^\n]*")
+
+
+# Canonical form of a query: comments dropped, whitespace collapsed, keywords
+# lower-cased (string literals are left untouched), trailing semicolon removed
+def normalize_sql(sql):
+    parts = _QUOTED.split(str(sql))
+    for i in range(0, len(parts), 2):
+        part = _LINE_COMMENT.sub(' ', parts[i])
+        parts[i] = re.sub(r"\s+", ' ', part).lower()
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+class QueryResultCache:
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_MB * 2**20):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.watermark = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (stored_at, nbytes, frame)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def make_key(self, sql, params=None, source='postgres'):
+        return source, normalize_sql(sql), tuple(sorted((params or {}).items()))
+
+    # Cached frame for key, or None. Callers must not modify the frame.
+    def get(self, key):
+        with self._lock:
+            frame = self._lookup(key)
+            if frame is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return frame
+
+    # Same as get without counting a hit or miss (call with the lock held)
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[0] > self.ttl:
+            self._drop(key)
+            entry = None
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, key, frame):
+        nbytes = int(frame.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time(), nbytes, frame)
+            self._bytes += nbytes
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    # Forget every cached result (e.g. after new stops were ingested)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # Clear the cache when the data it was built from has changed
+    def set_watermark(self, watermark):
+        if watermark != self.watermark:
+            self.clear()
+            self.watermark = watermark
+
+    # Run sql through the cache. Concurrent misses on the same key wait for a
+    # single database round trip instead of each running the query. run
+    # executes a miss (default: db.run_query on PostgreSQL); source names
+    # the engine it runs on, so the same SQL on two engines is cached apart.
+    def fetch(self, sql, params=None, watermark=None, name=None, cancel=None, run=run_query, source='postgres'):
+        if watermark is not None:
+            self.set_watermark(watermark)
+        key = self.make_key(sql, params, source)
+        frame = self.get(key)
+        if frame is not None:
+            return frame
+        with self._lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+        if not leader:
+            # The miss was counted above; the leader's result is read uncounted
+            event.wait()
+            with self._lock:
+                frame = self._lookup(key)
+            if frame is not None:
+                return frame
+        try:
+            frame = run(sql, params, name, cancel)
+            self.put(key, frame)
+            return frame
+        finally:
+            if leader:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+
+@st.cache_resource
+def get_result_cache():
+    return QueryResultCache()
+
+
+# Query results through the shared cache; errors are reported and not cached,
+# cancellation (QueryCancelled) is raised. Database round trips are timed
+# under name. run/source select another engine (see QueryResultCache.fetch).
+def cached_fetch(sql, params=None, watermark=None, name=None, cancel=None, run=run_query, source='postgres'):
+    try:
+        return get_result_cache().fetch(sql, params, watermark, name, cancel, run, source)
+    except QueryCancelled:
+        raise
+    except Exception as e:
+        print(f"Error executing query: {e}")
+        return pd.DataFrame()
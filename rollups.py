@@ -0,0 +1,326 @@
+# Pre-aggregated rollups of traffic_stops.
+# Dashboard metrics and most canned queries only need counts per
+# (date, country, violation, gender, race, age bucket, hour, outcome), so they
+# are answered from a summary instead of scanning every stop:
+#   - a PostgreSQL materialized view for the canned queries (query router).
+#     The router only uses the view once it has been refreshed for the
+#     dataset version the dashboard is showing; when new stops arrive it
+#     answers from traffic_stops and refreshes the view in the background.
+#   - the same rollup built in memory from the cleaned dataset, the
+#     benchmark baseline for the running aggregates in aggregates.py that
+#     serve the Key Metrics row and the charts
+#
+#   python rollups.py create    # create the materialized view and its index
+#   python rollups.py refresh   # refresh it (schedule this after loads)
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+
+from db import get_engine
+from profiling import timed
+from queries import MEDIUM_QUERIES, COMPLEX_QUERIES
+from schema import time_to_seconds
+from tasks import submit
+
+ROLLUP_VIEW = "traffic_stops_rollup"
+ROLLUP_KEYS = ['stop_date', 'country_name', 'violation', 'driver_gender', 'driver_race', 'age_bucket', 'stop_hour', 'stop_outcome']
+ROLLUP_MEASURES = ['stops', 'arrests', 'searches', 'drug_stops']
+# Shortest time between two background refreshes of the view
+ROLLUP_REFRESH_INTERVAL = int(os.environ.get("ENFORCEIQ_ROLLUP_REFRESH_INTERVAL", "300"))
+
+# Same age groups as the "highest arrest rate" query
+AGE_BINS = [-np.inf, 17, 25, 35, 50, 65, np.inf]
+AGE_LABELS = ['under18', '18-25', '26-35', '36-50', '51-65', '65+']
+
+CREATE_ROLLUP_SQL = f"""
+CREATE MATERIALIZED VIEW IF NOT EXISTS {ROLLUP_VIEW} AS
+SELECT
+    stop_date,
+    country_name,
+    violation,
+    driver_gender,
+    driver_race,
+    case
+        when driver_age is null then null
+        when driver_age < 18 then 'under18'
+        when driver_age <= 25 then '18-25'
+        when driver_age <= 35 then '26-35'
+        when driver_age <= 50 then '36-50'
+        when driver_age <= 65 then '51-65'
+        else '65+'
+    end AS age_bucket,
+    extract(hour from stop_time)::int AS stop_hour,
+    stop_outcome,
+    count(*) AS stops,
+    count(*) filter (where is_arrested = true) AS arrests,
+    count(*) filter (where search_conducted = true) AS searches,
+    count(*) filter (where drugs_related_stop = true) AS drug_stops
+FROM traffic_stops
+GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+"""
+
+# REFRESH ... CONCURRENTLY needs a unique index over the whole view
+CREATE_ROLLUP_INDEX_SQL = f"""
+CREATE UNIQUE INDEX IF NOT EXISTS {ROLLUP_VIEW}_key
+ON {ROLLUP_VIEW} ({', '.join(ROLLUP_KEYS)})
+"""
+
+# Canned queries that can be answered exactly from the rollup. Queries that
+# need exact ages, stop durations or minute-level times still run on traffic_stops.
+ROLLUP_QUERIES = {
+    "4. Gender distribution of drivers stopped in each country": f"""select country_name, driver_gender, sum(searches) as stop_counts from {ROLLUP_VIEW}
+group by country_name, driver_gender having sum(searches) > 0 order by country_name, stop_counts desc""",
+
+    "5. Which race and gender combination has the highest search rate ?": f"""select driver_gender, driver_race, sum(searches) as stop_counts from {ROLLUP_VIEW}
+group by driver_gender, driver_race having sum(searches) > 0 order by stop_counts desc limit :top_n""",
+
+    "6. What time of day sees the most traffic stops?": f"""select
+ case
+  when stop_hour between 5 and 11 then 'Morning'
+  when stop_hour between 12 and 16 then 'Noon'
+  when stop_hour between 17 and 20 then 'Evening'
+  else 'Night'
+end as time_of_day,
+sum(stops) as stop_counts from {ROLLUP_VIEW} where stop_hour is not null group by time_of_day order by stop_counts desc limit :top_n""",
+
+    "9. Which violations are most associated with searches or arrests?": f"""select violation, sum(stops) as stop_counts,
+(cast(sum(case when stop_outcome = 'Arrest' then stops else searches end) as numeric) / sum(stops)) * 100 as search_or_arrest_percent
+from {ROLLUP_VIEW} group by violation order by search_or_arrest_percent desc""",
+
+    "11. A violation that rarely results in search or arrest": f"""select violation, sum(stops) as stop_counts,
+(cast(sum(case when stop_outcome = 'Arrest' then stops else searches end) as numeric) / sum(stops)) * 100 as search_or_arrest_percent
+from {ROLLUP_VIEW} group by violation order by search_or_arrest_percent asc limit :top_n""",
+
+    "12. Which countries report the highest rate of drug-related stops?": f"""select country_name, sum(drug_stops) as stop_counts from {ROLLUP_VIEW}
+group by country_name having sum(drug_stops) > 0 order by stop_counts desc""",
+
+    "13. The arrest rate by country and violation": f"""select country_name, violation,
+cast(sum(case when stop_outcome = 'Arrest' then stops else 0 end) as numeric) / sum(stops) * 100 as arrest_percentage
+from {ROLLUP_VIEW} group by violation, country_name order by arrest_percentage desc""",
+
+    "14. Which country has the most stops with search conducted?": f"""select country_name, sum(searches) as stop_counts from {ROLLUP_VIEW}
+group by country_name having sum(searches) > 0 order by stop_counts desc limit :top_n""",
+
+    "1. Yearly Breakdown of Stops and Arrests by Country": f"""SELECT
+    stop_year,
+    country_name,
+    total_stops,
+    total_arrests,
+    (CAST(total_arrests AS NUMERIC) * 100 / total_stops) AS arrest_rate_percent_yearly,
+    SUM(total_stops) OVER (PARTITION BY country_name ORDER BY stop_year) AS running_total_stops_per_year,
+    SUM(total_arrests) OVER (PARTITION BY country_name ORDER BY stop_year) AS running_total_arrests_per_year
+FROM (
+    SELECT EXTRACT(YEAR FROM stop_date) AS stop_year, country_name, SUM(stops) AS total_stops, SUM(arrests) AS total_arrests
+    FROM {ROLLUP_VIEW}
+    WHERE stop_date IS NOT NULL
+    GROUP BY stop_year, country_name
+) AS yearly_country_summary
+ORDER BY stop_year ASC, country_name ASC""",
+
+    "3. Time Period Analysis of Stops & Number of Stops by Year,Month, Hour of the Day": f"""select
+    extract(year from stop_date) as stop_year,
+    to_char(stop_date, 'Month') as stop_month_name,
+    extract(month from stop_date) as stop_month,
+    stop_hour,
+    sum(stops) as total_stops
+from {ROLLUP_VIEW}
+where stop_date is not null and stop_hour is not null
+group by stop_year, stop_month_name, stop_month, stop_hour
+order by stop_year, stop_month, stop_hour""",
+
+    "4. Violations with High Search and Arrest Rates": f"""select
+    violation, total_stops, stops_with_search, percentage_searched, stops_with_arrest, percentage_arrested,
+    dense_rank() over (order by percentage_searched desc) as search_rate_rank,
+    dense_rank() over (order by percentage_arrested desc) as arrest_rate_rank
+from (
+    select
+        violation,
+        sum(stops) as total_stops,
+        sum(searches) as stops_with_search,
+        (sum(searches)::numeric * 100 / sum(stops)) as percentage_searched,
+        sum(arrests) as stops_with_arrest,
+        (sum(arrests)::numeric * 100 / sum(stops)) as percentage_arrested
+    from {ROLLUP_VIEW}
+    where violation is not null
+    group by violation
+) as violation_stats
+where total_stops > 0
+order by percentage_searched desc, percentage_arrested desc""",
+
+    "6. Top 5 Violations with Highest Arrest Rates": f"""select violation,
+cast(sum(case when stop_outcome = 'Arrest' then stops else 0 end) as numeric) / sum(stops) * 100 as arrest_percentage
+from {ROLLUP_VIEW} group by violation order by arrest_percentage desc""",
+}
+
+# Routes are keyed by the original query text
+_ROUTES = {
+    sql: ROLLUP_QUERIES[name]
+    for queries in (MEDIUM_QUERIES, COMPLEX_QUERIES)
+    for name, sql in queries.items()
+    if name in ROLLUP_QUERIES
+}
+
+
+def create_rollups():
+    with get_engine().begin() as conn:
+        conn.execute(text(CREATE_ROLLUP_SQL))
+        conn.execute(text(CREATE_ROLLUP_INDEX_SQL))
+
+
+# Recompute the materialized view. CONCURRENTLY keeps it readable during the
+# refresh but only works once it has been populated.
+def refresh_rollups(concurrently=True):
+    keyword = "CONCURRENTLY " if concurrently and _rollup_populated() else ""
+    with get_engine().begin() as conn:
+        conn.execute(text(f"REFRESH MATERIALIZED VIEW {keyword}{ROLLUP_VIEW}"))
+    rollup_available.clear()
+
+
+def _rollup_populated():
+    with get_engine().connect() as conn:
+        populated = conn.execute(
+            text("SELECT ispopulated FROM pg_matviews WHERE matviewname = :name"),
+            {'name': ROLLUP_VIEW},
+        ).scalar()
+    return bool(populated)
+
+
+# Whether the materialized view exists and has data (checked once a minute)
+@st.cache_data(ttl=60, show_spinner=False)
+def rollup_available():
+    try:
+        return _rollup_populated()
+    except Exception:
+        return False
+
+
+# Dataset version (TrafficStopsStore.data_version) the view was last
+# refreshed for by this process, and the running background refresh
+_freshness = {'version': None, 'started': None, 'task': None}
+_freshness_lock = threading.Lock()
+
+
+# Whether the view covers every stop of data_version. If it does not, a
+# background refresh is started (at most once per ROLLUP_REFRESH_INTERVAL);
+# the store loaded data_version before the refresh starts, so the refreshed
+# view covers it.
+def rollup_current(data_version):
+    with _freshness_lock:
+        if _freshness['version'] == data_version:
+            return True
+        task, started = _freshness['task'], _freshness['started']
+        if task is not None and not task.done():
+            return False
+        if started is not None and time.time() - started < ROLLUP_REFRESH_INTERVAL:
+            return False
+        _freshness['started'] = time.time()
+        _freshness['task'] = submit(_refresh_for, data_version, name=f"Refreshing {ROLLUP_VIEW}")
+    return False
+
+
+# Start refreshing the view for data_version right away (e.g. after new
+# stops were written) instead of on the next query the router could send to it
+def refresh_rollups_for(data_version):
+    if rollup_available():
+        rollup_current(data_version)
+
+
+def _refresh_for(data_version):
+    try:
+        refresh_rollups()
+    except Exception as e:
+        print(f"Error refreshing {ROLLUP_VIEW}: {e}")
+        return
+    with _freshness_lock:
+        _freshness['version'] = data_version
+
+
+# SQL to run for a canned query: the rollup version when one exists and the
+# materialized view is ready and current for data_version, otherwise the
+# original query. Queries with pushed-down filters never match and always
+# run on traffic_stops. Returns (sql, answered_from_rollup).
+def route_query(sql, data_version):
+    routed = _ROUTES.get(sql)
+    if routed is not None and rollup_available() and rollup_current(data_version):
+        return routed, True
+    return sql, False
+
+
+# Same rollup computed in memory from the cleaned dataset
+def build_rollup(data):
+    keys = [
+        data['stop_date'],
+        data['country_name'],
+        data['violation'],
+        data['driver_gender'],
+        data['driver_race'],
+        pd.cut(data['driver_age'], bins=AGE_BINS, labels=AGE_LABELS).rename('age_bucket'),
+        (time_to_seconds(data['stop_time']) // 3600).rename('stop_hour'),
+        data['stop_outcome'],
+    ]
+    measures = pd.DataFrame({
+        'stops': 1,
+        'arrests': data['is_arrested'].astype('int64'),
+        'searches': data['search_conducted'].astype('int64'),
+        'drug_stops': data['drugs_related_stop'].astype('int64'),
+    }, index=data.index)
+    with timed('build_rollup') as timing:
+        rollup = measures.groupby(keys, observed=True, dropna=False).sum().reset_index()
+        return timing.observe(rollup)
+
+
+# Numbers for the Key Metrics row
+def key_metrics(rollup):
+    outcomes = rollup.groupby('stop_outcome', observed=True)['stops'].sum()
+    violations = rollup.groupby('violation', observed=True)['stops'].sum()
+    return {
+        'total_stops': int(rollup['stops'].sum()),
+        'total_arrests': int(rollup['arrests'].sum()),
+        'unique_outcomes': int((outcomes > 0).sum()),
+        'unique_violations': int((violations > 0).sum()),
+        'most_common_outcome': outcomes.idxmax() if len(outcomes) else None,
+    }
+
+
+# Stops per gender, year, country and outcome for the demographics chart
+def demographics(rollup):
+    year = pd.to_datetime(rollup['stop_date']).dt.year.rename('year')
+    return (
+        rollup
+        .groupby([rollup['driver_gender'], year, rollup['country_name'], rollup['stop_outcome']], observed=True)['stops']
+        .sum()
+        .reset_index(name='count')
+    )
+
+
+# Stops per violation for the pie chart
+def violation_counts(rollup):
+    counts = rollup.groupby('violation', observed=True)['stops'].sum()
+    counts = counts[counts > 0].sort_values(ascending=False).reset_index()
+    counts.columns = ['Violation', 'Count']
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the traffic_stops rollup materialized view")
+    parser.add_argument('command', choices=['create', 'refresh'])
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    if args.command == 'create':
+        create_rollups()
+    else:
+        refresh_rollups()
+    print(f"{ROLLUP_VIEW} ready in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+# Compact in-memory representation of the cleaned traffic_stops frame.
+# clean_data leaves most fields as Python object strings and int64 ages; at
+# tens of millions of rows that dominates the memory of every worker process.
+#
+#   python schema.py check   # check that malformed stop times are rejected
+
+import argparse
+import datetime
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+STRING_COLUMNS = ['driver_gender', 'driver_race', 'country_name', 'violation', 'stop_outcome', 'search_type', 'stop_duration']
+BOOL_COLUMNS = ['search_conducted', 'drugs_related_stop', 'is_arrested']
+
+# Use Arrow-backed dtypes for the columns that stay string/boolean
+ARROW_DTYPES = os.environ.get("ENFORCEIQ_ARROW_DTYPES", "0") == "1"
+
+# Free-text column that is only categorised when values repeat often enough
+HIGH_CARDINALITY_COLUMNS = ['vehicle_number']
+CATEGORY_MAX_RATIO = 0.5
+# How the free-text columns are stored: 'category', 'string' or 'auto'
+# (category when the first chunk of a load repeats values often enough).
+# Chosen once per load, so every chunk gets the same dtype.
+HIGH_CARDINALITY_DTYPE = os.environ.get("ENFORCEIQ_HIGH_CARDINALITY_DTYPE", "auto")
+
+
+# A whole "HH:MM:SS" time string, optionally with fractional seconds
+TIME_PATTERN = r'^(\d{1,2}):(\d{2}):(\d{2})(?:\.\d+)?$'
+
+
+# Seconds since midnight (nullable int32) from datetime.time values or "HH:MM:SS" strings
+def time_to_seconds(series):
+    if pd.api.types.is_integer_dtype(series) or pd.api.types.is_float_dtype(series):
+        return series.astype('Int32')
+    if pd.api.types.is_timedelta64_dtype(series):
+        return (series // pd.Timedelta(seconds=1)).astype('Int32')
+    if not pd.api.types.is_datetime64_any_dtype(series):
+        valid = series.notna().to_numpy()
+        values = series.to_numpy(dtype=object)[valid]
+        if len(values) and all(isinstance(value, datetime.time) for value in values[:1]):
+            # Driver-returned time objects: read the fields directly
+            try:
+                seconds = np.fromiter(
+                    (value.hour * 3600 + value.minute * 60 + value.second for value in values),
+                    dtype=np.int32, count=len(values),
+                )
+                result = np.zeros(len(series), dtype=np.int32)
+                result[valid] = seconds
+                return pd.Series(pd.arrays.IntegerArray(result, ~valid), index=series.index)
+            except AttributeError:
+                pass
+        return time_string_seconds(series)
+    seconds = series.dt.hour * 3600 + series.dt.minute * 60 + series.dt.second
+    return seconds.astype('Int32')
+
+
+# Seconds since midnight from "HH:MM:SS" strings (fractional seconds are
+# ignored). Anything else, including out-of-range fields and extra
+# characters, is NA.
+def time_string_seconds(series):
+    fields = series.astype('string').str.extract(TIME_PATTERN).astype('Int32')
+    hours, minutes, seconds = fields[0], fields[1], fields[2]
+    valid = hours.between(0, 23) & minutes.between(0, 59) & seconds.between(0, 59)
+    total = hours * 3600 + minutes * 60 + seconds
+    return total.where(valid.fillna(False).astype(bool)).astype('Int32')
+
+
+# datetime.time values back from seconds since midnight
+def seconds_to_time(seconds):
+    return (pd.Timestamp(0) + pd.to_timedelta(seconds.astype('Float64'), unit='s')).dt.time
+
+
+# "HH:MM:SS" strings back from seconds since midnight (for display)
+def seconds_to_time_str(seconds):
+    seconds = seconds.astype('Int32')
+    return (
+        (seconds // 3600).astype(str).str.zfill(2) + ':'
+        + (seconds % 3600 // 60).astype(str).str.zfill(2) + ':'
+        + (seconds % 60).astype(str).str.zfill(2)
+    ).where(seconds.notna())
+
+
+def _arrow_dtype(arrow_type):
+    import pyarrow as pa
+    return pd.ArrowDtype(getattr(pa, arrow_type)())
+
+
+# Storage ('category' or 'string') of each free-text column of df. For a
+# compacted frame (the first chunk of a load, or the loaded data) this is
+# what it already uses; otherwise the configured choice, or decided from how
+# often df repeats values. Pass the result for the first chunk of a load to
+# compact_frame for the others.
+def high_cardinality_dtypes(df, compacted=False):
+    dtypes = {}
+    for col in HIGH_CARDINALITY_COLUMNS:
+        if col not in df.columns:
+            continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            dtypes[col] = 'category'
+        elif compacted:
+            dtypes[col] = 'string'
+        elif HIGH_CARDINALITY_DTYPE != 'auto':
+            dtypes[col] = HIGH_CARDINALITY_DTYPE
+        elif len(df) and df[col].nunique() / len(df) <= CATEGORY_MAX_RATIO:
+            dtypes[col] = 'category'
+        else:
+            dtypes[col] = 'string'
+    return dtypes
+
+
+# Convert a cleaned frame to the compact schema. text_dtypes fixes the
+# storage of the free-text columns (see high_cardinality_dtypes).
+def compact_frame(df, arrow=ARROW_DTYPES, text_dtypes=None):
+    if arrow:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            arrow = False
+    text_dtypes = text_dtypes or high_cardinality_dtypes(df)
+    df = df.copy()
+
+    # Low-cardinality text fields become categoricals
+    for col in STRING_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    for col in HIGH_CARDINALITY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            if text_dtypes.get(col) == 'category':
+                df[col] = df[col].astype('category')
+            elif arrow:
+                df[col] = df[col].astype(_arrow_dtype('string'))
+            else:
+                df[col] = df[col].astype('string')
+
+    # Booleans without object fallback
+    for col in BOOL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].fillna(False).astype(bool)
+            if arrow:
+                df[col] = df[col].astype(_arrow_dtype('bool_'))
+
+    # Ages fit in a byte
+    if 'driver_age' in df.columns:
+        ages = df['driver_age']
+        if len(ages) == 0 or (ages.min() >= 0 and ages.max() <= 255):
+            df['driver_age'] = ages.astype('uint8')
+        else:
+            df['driver_age'] = pd.to_numeric(ages, downcast='integer')
+
+    if 'stop_time' in df.columns:
+        df['stop_time'] = time_to_seconds(df['stop_time'])
+
+    # Any other integer columns (ids etc.) are downcast
+    for col in df.columns:
+        if col not in ('driver_age', 'stop_time') and isinstance(df[col].dtype, np.dtype) and df[col].dtype.kind in 'iu':
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+
+    return df
+
+
+# Concatenate compact frames, keeping categorical columns categorical.
+# Categories are only ever appended, so codes already in use stay stable.
+def concat_frames(frames):
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        return pd.DataFrame()
+    first = frames[0]
+    categories = {}
+    for col in first.columns:
+        if isinstance(first[col].dtype, pd.CategoricalDtype):
+            categories[col] = list(first[col].cat.categories)
+    for col, values in categories.items():
+        known = set(values)
+        for frame in frames[1:]:
+            if col not in frame.columns:
+                continue
+            new_values = frame[col].cat.categories if isinstance(frame[col].dtype, pd.CategoricalDtype) else frame[col].dropna().unique()
+            values.extend(value for value in new_values if value not in known)
+            known.update(new_values)
+    dtypes = {col: pd.CategoricalDtype(values) for col, values in categories.items()}
+    aligned = []
+    for frame in frames:
+        changed = {col: dtype for col, dtype in dtypes.items() if col in frame.columns and frame[col].dtype != dtype}
+        aligned.append(frame.astype(changed) if changed else frame)
+    return pd.concat(aligned, ignore_index=True)
+
+
+# Deep memory usage of a frame in bytes
+def memory_footprint(df):
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+# Deep memory usage per column in bytes (summed over chunks to get the raw size)
+def column_memory(df):
+    return df.memory_usage(deep=True, index=False)
+
+
+# Before/after memory usage per column, largest savings first. before holds
+# bytes per column (column_memory of the raw data), after is the compact frame.
+def memory_report(before, after):
+    report = pd.DataFrame({
+        'before_bytes': before,
+        'after_bytes': column_memory(after),
+    }).fillna(0).astype('int64')
+    report['dtype'] = [str(after[col].dtype) if col in after.columns else '' for col in report.index]
+    report['saved_bytes'] = report['before_bytes'] - report['after_bytes']
+    return report.sort_values('saved_bytes', ascending=False)
+
+
+# Expected seconds (None: rejected) for time strings time_to_seconds must parse strictly
+TIME_CHECKS = {
+    '00:00:00': 0,
+    '9:05:07': 32707,
+    '23:59:59': 86399,
+    '10:00:00.5': 36000,
+    '10:00:00.123456': 36000,
+    '24:00:00': None,
+    '25:00:00': None,
+    '10:60:00': None,
+    '10:00:60': None,
+    '110:00:00': None,
+    'x10:00:00': None,
+    '10:00:00abc': None,
+    '10:00': None,
+    '10:00:00.': None,
+    '': None,
+}
+
+
+# Check time_to_seconds against TIME_CHECKS; returns a list of problems
+def check_time_parsing():
+    values = pd.Series(list(TIME_CHECKS) + [None], dtype=object)
+    parsed = time_to_seconds(values)
+    problems = []
+    for value, expected, got in zip(values, list(TIME_CHECKS.values()) + [None], parsed):
+        got = None if pd.isna(got) else int(got)
+        if got != expected:
+            problems.append(f"time_to_seconds({value!r}) = {got}, expected {expected}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the compact schema conversions")
+    parser.add_argument('command', choices=['check'])
+    parser.parse_args(argv)
+    problems = check_time_parsing()
+    for problem in problems:
+        print(f"✗ {problem}")
+    if problems:
+        return 1
+    print(f"✓ {len(TIME_CHECKS)} time strings parsed as expected")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# Shared-memory dataset for running several dashboard workers on one box.
+# One loader process loads and cleans traffic_stops, publishes it as an
+# uncompressed Arrow IPC file in SHARED_DIR (a tmpfs, /dev/shm by default)
+# and republishes after every sync that brings new stops. Workers started
+# with ENFORCEIQ_SHARED_MEMORY=1 memory-map the published file instead of
+# loading their own copy: the column buffers are the file's pages, mapped
+# by every worker, so eight workers cost about the memory of one. Workers
+# pick up a new version by polling the manifest, and can ask the loader for
+# a full reload (after a back-fill a delta sync cannot see).
+#
+#   python shared.py serve     # loader: publish, then sync and republish
+#   python shared.py status    # show the published version
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from snapshot import decode_watermark, encode_watermark
+
+SHARED_MEMORY = os.environ.get("ENFORCEIQ_SHARED_MEMORY", "0") != "0"
+SHARED_DIR = os.environ.get("ENFORCEIQ_SHARED_DIR", "/dev/shm/enforceiq")
+# How often workers look for a newer published version
+SHARED_POLL_SECONDS = float(os.environ.get("ENFORCEIQ_SHARED_POLL_SECONDS", "5"))
+# Published versions kept on disk (workers may still be reading older ones)
+SHARED_KEEP = 2
+
+MANIFEST_FILE = "manifest.json"
+RELOAD_FILE = "reload.request"
+FILE_PATTERN = "traffic_stops-{version}.arrow"
+
+
+# Read the manifest of the published dataset (None if nothing is published)
+def read_shared_manifest(path=SHARED_DIR):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Publish the cleaned frame as the next version. append_of names the
+# version this one only appends rows to, so workers can fold in just the
+# new rows. Files are written next to the target and renamed into place.
+def publish(data, state, append_of=None, path=SHARED_DIR):
+    import pyarrow as pa
+
+    previous = read_shared_manifest(path)
+    version = previous['version'] + 1 if previous else 1
+    os.makedirs(path, exist_ok=True)
+    name = FILE_PATTERN.format(version=version)
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    tmp_file = os.path.join(path, f".{name}.tmp-{os.getpid()}")
+    with pa.OSFile(tmp_file, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_file, os.path.join(path, name))
+
+    manifest = {
+        'version': version,
+        'file': name,
+        'published_at': time.time(),
+        'row_count': len(data),
+        'bytes': os.path.getsize(os.path.join(path, name)),
+        'append_of': append_of,
+        'sync_mode': state['sync_mode'],
+        'watermark': encode_watermark(state['watermark']),
+        'boundary_hashes': [int(h) for h in state['boundary_hashes']],
+        'age_median': state['age_median'],
+    }
+    tmp_manifest = os.path.join(path, f".{MANIFEST_FILE}.tmp-{os.getpid()}")
+    with open(tmp_manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_manifest, os.path.join(path, MANIFEST_FILE))
+    _remove_old_versions(path, version)
+    return manifest
+
+
+# Ask the loader to reload the whole table from the database and publish it
+# as a new full version (picked up at its next sync)
+def request_reload(path=SHARED_DIR):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, RELOAD_FILE), 'w') as f:
+        f.write(str(time.time()))
+
+
+# True (once) if a worker asked for a reload. The request is removed before
+# the reload starts, so one made during the reload gets another.
+def _take_reload_request(path):
+    try:
+        os.remove(os.path.join(path, RELOAD_FILE))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+# Unlink all but the newest SHARED_KEEP files. Workers that still map an
+# unlinked file keep reading it until they move to a newer version.
+def _remove_old_versions(path, version):
+    for file in glob.glob(os.path.join(path, FILE_PATTERN.format(version='*'))):
+        number = os.path.basename(file)[len('traffic_stops-'):-len('.arrow')]
+        if number.isdigit() and int(number) <= version - SHARED_KEEP:
+            os.remove(file)
+
+
+# Booleans and plain strings stay in their Arrow buffers instead of being
+# converted to NumPy (categoricals, numbers and dates map without a copy)
+def _zero_copy_types(arrow_type):
+    import pyarrow as pa
+
+    if pa.types.is_boolean(arrow_type) or pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+# Map a published version and return the frame plus the sync state. The
+# frame is backed by the shared file and is read-only.
+def attach_shared(manifest, path=SHARED_DIR):
+    import pyarrow as pa
+
+    source = pa.memory_map(os.path.join(path, manifest['file']))
+    table = pa.ipc.open_file(source).read_all()
+    data = table.to_pandas(split_blocks=True, self_destruct=False, types_mapper=_zero_copy_types)
+    state = {
+        'sync_mode': manifest['sync_mode'],
+        'watermark': decode_watermark(manifest['watermark']),
+        'boundary_hashes': set(manifest['boundary_hashes']),
+        'age_median': manifest['age_median'],
+    }
+    return data, state
+
+
+# Loader: load (from the snapshot when possible), publish, then sync every
+# interval seconds and publish again whenever new stops arrived. A reload
+# requested by a worker replaces the sync with a full reload from the
+# database.
+def serve(interval, path=SHARED_DIR):
+    from dataset import USE_SNAPSHOT, TrafficStopsStore, restore_snapshot
+
+    store = TrafficStopsStore()
+    if not (USE_SNAPSHOT and restore_snapshot(store)):
+        store.load()
+    manifest = publish(store.data, store.sync_state(), path=path)
+    print(f"Published v{manifest['version']}: {manifest['row_count']:,} rows, {manifest['bytes'] / 2**20:,.1f} MB", flush=True)
+    while True:
+        time.sleep(interval)
+        if _take_reload_request(path):
+            try:
+                store.reload()
+            except Exception as e:
+                print(f"Error reloading traffic stops: {e}", flush=True)
+                request_reload(path)
+                continue
+            manifest = publish(store.data, store.sync_state(), path=path)
+            print(f"Published v{manifest['version']}: reloaded, {manifest['row_count']:,} rows", flush=True)
+            continue
+        try:
+            new_rows = store.sync()
+        except Exception as e:
+            print(f"Error syncing traffic stops: {e}", flush=True)
+            continue
+        if not new_rows:
+            continue
+        # xmin mode replaces updated rows, so the new version is not a pure append
+        append_of = manifest['version'] if store.sync_mode != 'xmin' else None
+        manifest = publish(store.data, store.sync_state(), append_of, path)
+        print(f"Published v{manifest['version']}: +{new_rows:,} rows, {manifest['row_count']:,} total", flush=True)
+
+
+def main(argv=None):
+    from dataset import SYNC_INTERVAL
+
+    parser = argparse.ArgumentParser(description="Publish traffic_stops to shared memory for dashboard workers")
+    parser.add_argument('command', choices=['serve', 'status'])
+    parser.add_argument('--path', default=SHARED_DIR, help="Directory the dataset is published in (a tmpfs)")
+    parser.add_argument('--interval', type=float, default=SYNC_INTERVAL, help="Seconds between syncs")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve(args.interval, args.path)
+        return 0
+
+    manifest = read_shared_manifest(args.path)
+    if manifest is None:
+        print(f"✗ Nothing published in {args.path}")
+        return 1
+    published = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['published_at']))
+    print(f"✓ v{manifest['version']}: {manifest['row_count']:,} rows, {manifest['bytes'] / 2**20:,.1f} MB, published {published}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
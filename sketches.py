@@ -0,0 +1,271 @@
+# Sketches for the dashboard's approximate query mode.
+# Exploratory questions (distinct vehicles, most stopped or searched
+# vehicles, age percentiles, rates per country and year) are answered from
+# small summaries kept in step with the data instead of scanning it, so
+# they take milliseconds at any table size and come with an error bound:
+#   - HyperLogLog for distinct vehicles
+#   - Count-Min sketches plus a candidate list for the top vehicles and violations
+#   - a histogram of driver ages for percentiles (ages are whole years, so
+#     this is exact and smaller than a t-digest)
+#   - reservoir samples per (country, year) for arrest/search/drug rates
+# Synced stops are added with sign +1; replaced rows are taken out with
+# sign -1 where a sketch can forget (the Count-Min sketches and the ages).
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+HLL_PRECISION = int(os.environ.get("ENFORCEIQ_SKETCH_HLL_PRECISION", "14"))
+COUNT_MIN_WIDTH = int(os.environ.get("ENFORCEIQ_SKETCH_CM_WIDTH", "65536"))
+COUNT_MIN_DEPTH = 4
+SAMPLE_PER_STRATUM = int(os.environ.get("ENFORCEIQ_SKETCH_SAMPLE_SIZE", "2000"))
+TOP_K = 10
+Z_95 = 1.96
+RATE_COLUMNS = ['is_arrested', 'search_conducted', 'drugs_related_stop']
+
+
+# 64-bit hash per value; categoricals hash their categories, so the same
+# value hashes the same in every batch
+def _hashes(values):
+    return pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy()
+
+
+# Number of significant bits of each uint64 (0 for 0)
+def _bit_length(values):
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        if not len(values):
+            return
+        hashes = _hashes(values)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - _bit_length(rest) + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * np.log(m / zeros)  # linear counting for small cardinalities
+        return raw
+
+    # Relative standard error of the estimate
+    def relative_error(self):
+        return 1.04 / np.sqrt(len(self.registers))
+
+
+# Count-Min sketch with a list of heavy-hitter candidates. Estimates never
+# undercount and overcount by at most e / width * total with probability
+# 1 - e^-depth.
+class HeavyHitters:
+    def __init__(self, width=COUNT_MIN_WIDTH, depth=COUNT_MIN_DEPTH, top_k=TOP_K):
+        self.width = width
+        self.depth = depth
+        self.top_k = top_k
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self.candidates = set()
+
+    def _columns(self, values):
+        hashes = _hashes(values)
+        first = hashes & np.uint64(0xFFFFFFFF)
+        second = (hashes >> np.uint64(32)) | np.uint64(1)
+        return [((first + np.uint64(row) * second) % np.uint64(self.width)).astype(np.int64) for row in range(self.depth)]
+
+    # Add a batch of values (or take it out again with sign=-1)
+    def add(self, values, sign=1):
+        counts = pd.Series(values).value_counts()
+        counts = counts[counts > 0]
+        if counts.empty:
+            return
+        for row, columns in enumerate(self._columns(counts.index.to_numpy())):
+            np.add.at(self.table[row], columns, sign * counts.to_numpy())
+        self.total += sign * int(counts.sum())
+        if sign > 0:
+            # Values frequent in this batch may become heavy hitters overall
+            self.candidates.update(counts.index[:4 * self.top_k])
+            estimates = self.estimate(list(self.candidates))
+            self.candidates = set(estimates.nlargest(4 * self.top_k).index)
+
+    def estimate(self, values):
+        if not values:
+            return pd.Series(dtype='int64')
+        columns = self._columns(np.asarray(values, dtype=object))
+        counts = np.min([self.table[row][columns[row]] for row in range(self.depth)], axis=0)
+        return pd.Series(counts, index=values)
+
+    def error_bound(self):
+        return int(np.ceil(np.e / self.width * self.total))
+
+    def top(self, k=None):
+        estimates = self.estimate(list(self.candidates))
+        return estimates.sort_values(ascending=False, kind='stable').head(k or self.top_k)
+
+
+# Per (country, year) reservoir sample of the rate columns plus the exact
+# number of stops in each stratum
+class StratifiedSample:
+    def __init__(self, size=SAMPLE_PER_STRATUM, seed=0):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.seen = {}     # stratum -> stops seen
+        self.samples = {}  # stratum -> array (rows, RATE_COLUMNS)
+
+    def add(self, frame):
+        if not len(frame):
+            return
+        values = frame[RATE_COLUMNS].astype(bool).to_numpy()
+        year = pd.to_datetime(frame['stop_date']).dt.year
+        for stratum, rows in frame.groupby([frame['country_name'], year], observed=True).indices.items():
+            seen = self.seen.get(stratum, 0)
+            sample = self.samples.get(stratum, np.empty((0, len(RATE_COLUMNS)), dtype=bool))
+            # Fill the reservoir first, then row i replaces a random slot with probability size / i
+            fill = max(0, min(self.size - len(sample), len(rows)))
+            sample = np.concatenate([sample, values[rows[:fill]]])
+            rest = rows[fill:]
+            if len(rest):
+                positions = seen + fill + 1 + np.arange(len(rest))
+                slots = (self.rng.random(len(rest)) * positions).astype(np.int64)
+                keep = slots < self.size
+                sample[slots[keep]] = values[rest[keep]]
+            self.seen[stratum] = seen + len(rows)
+            self.samples[stratum] = sample
+
+    # Rate per stratum with a 95% interval (finite population corrected, so
+    # strata that are sampled completely are exact)
+    def rates(self):
+        rows = []
+        for (country, year), sample in sorted(self.samples.items()):
+            population, n = self.seen[(country, year)], len(sample)
+            correction = (population - n) / (population - 1) if population > 1 else 0.0
+            row = {'country_name': country, 'year': int(year), 'stops': population, 'sampled': n}
+            for col, rate in zip(RATE_COLUMNS, sample.mean(axis=0)):
+                row[f'{col}_percent'] = rate * 100
+                row[f'{col}_error'] = Z_95 * np.sqrt(rate * (1 - rate) / n * correction) * 100
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+
+class SketchStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.vehicles = HyperLogLog()
+        self.top_vehicles = HeavyHitters()
+        self.searched_vehicles = HeavyHitters()
+        self.violations = HeavyHitters()
+        self.ages = np.zeros(256, dtype=np.int64)
+        self.sample = StratifiedSample()
+
+    def build(self, data):
+        with self._lock:
+            self._reset()
+        self.update(data)
+
+    # Fold a batch of new stops in. Replaced rows are taken out of the counts
+    # and the age histogram; HyperLogLog and the samples cannot forget rows,
+    # so they keep the old version of an updated stop as well.
+    def update(self, delta, removed=None):
+        with self._lock:
+            if delta is not None and len(delta):
+                self.vehicles.add(delta['vehicle_number'].dropna())
+                self.top_vehicles.add(delta['vehicle_number'].dropna())
+                searched = delta['search_conducted'].astype(bool).to_numpy()
+                self.searched_vehicles.add(delta['vehicle_number'][searched].dropna())
+                self.violations.add(delta['violation'].dropna())
+                self._add_ages(delta['driver_age'])
+                self.sample.add(delta)
+            if removed is not None and len(removed):
+                self.top_vehicles.add(removed['vehicle_number'].dropna(), sign=-1)
+                searched = removed['search_conducted'].astype(bool).to_numpy()
+                self.searched_vehicles.add(removed['vehicle_number'][searched].dropna(), sign=-1)
+                self.violations.add(removed['violation'].dropna(), sign=-1)
+                self._add_ages(removed['driver_age'], sign=-1)
+
+    def _add_ages(self, ages, sign=1):
+        ages = pd.to_numeric(ages, errors='coerce').dropna().astype(np.int64).to_numpy()
+        if len(ages) and ages.max() >= len(self.ages):
+            self.ages = np.pad(self.ages, (0, int(ages.max()) + 1 - len(self.ages)))
+        self.ages += sign * np.bincount(ages.clip(0), minlength=len(self.ages))
+
+    def distinct_vehicles(self):
+        with self._lock:
+            estimate = self.vehicles.estimate()
+            error = estimate * self.vehicles.relative_error() * Z_95
+        return pd.DataFrame([{'distinct_vehicles': round(estimate), 'error': round(error)}])
+
+    def _top(self, sketch, column):
+        with self._lock:
+            top, bound = sketch.top(), sketch.error_bound()
+        frame = top.rename_axis(column).reset_index(name='stop_counts')
+        frame['overcount_at_most'] = bound
+        return frame
+
+    def top_vehicles_stopped(self):
+        return self._top(self.top_vehicles, 'vehicle_number')
+
+    def top_vehicles_searched(self):
+        return self._top(self.searched_vehicles, 'vehicle_number')
+
+    def top_violations(self):
+        return self._top(self.violations, 'violation')
+
+    def age_percentiles(self, percentiles=(5, 25, 50, 75, 95, 99)):
+        with self._lock:
+            cumulative = np.cumsum(self.ages)
+        total = cumulative[-1] if len(cumulative) else 0
+        rows = []
+        for p in percentiles:
+            age = int(np.searchsorted(cumulative, total * p / 100)) if total else None
+            rows.append({'percentile': p, 'driver_age': age, 'error': 0})
+        return pd.DataFrame(rows)
+
+    def rates_by_country_year(self):
+        with self._lock:
+            return self.sample.rates()
+
+    # Country rates combined from the year strata, weighted by stops
+    def rates_by_country(self):
+        strata = self.rates_by_country_year()
+        if strata.empty:
+            return strata
+        rows = []
+        for country, group in strata.groupby('country_name', sort=True):
+            weights = group['stops'] / group['stops'].sum()
+            row = {'country_name': country, 'stops': int(group['stops'].sum()), 'sampled': int(group['sampled'].sum())}
+            for col in RATE_COLUMNS:
+                row[f'{col}_percent'] = float((weights * group[f'{col}_percent']).sum())
+                row[f'{col}_error'] = float(np.sqrt((weights ** 2 * group[f'{col}_error'] ** 2).sum()))
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+
+# Approximate questions -> SketchStore method answering them
+APPROXIMATE_QUERIES = {
+    "Distinct vehicles stopped": 'distinct_vehicles',
+    "Most frequently stopped vehicles": 'top_vehicles_stopped',
+    "Most frequently searched vehicles": 'top_vehicles_searched',
+    "Most common violations": 'top_violations',
+    "Driver age percentiles": 'age_percentiles',
+    "Arrest, search and drug rates by country": 'rates_by_country',
+    "Arrest, search and drug rates by country and year": 'rates_by_country_year',
+}
+
+
+def approximate_answer(sketches, name):
+    return getattr(sketches, APPROXIMATE_QUERIES[name])()
@@ -0,0 +1,168 @@
+# Local Parquet snapshots of the cleaned traffic_stops frame.
+# A snapshot lets the app start from disk in seconds (and keep working when the
+# database is slow) and then catch up with PostgreSQL through an incremental sync.
+#
+#   python snapshot.py build    # load + clean from PostgreSQL, write snapshot
+#   python snapshot.py build --from-csv stops.csv   # same from a CSV export (no database)
+#   python snapshot.py verify   # check an existing snapshot
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import pandas as pd
+
+# Bump whenever clean_data or the compact schema changes the stored layout
+SCHEMA_VERSION = 1
+
+SNAPSHOT_DIR = os.environ.get("ENFORCEIQ_SNAPSHOT_DIR", "snapshots/traffic_stops")
+MANIFEST_FILE = "_manifest.json"
+PARTITION_COLUMNS = ['year', 'country_name']
+
+
+def encode_watermark(watermark):
+    if watermark is None:
+        return None
+    if isinstance(watermark, pd.Timestamp):
+        return {'type': 'timestamp', 'value': watermark.isoformat()}
+    return {'type': 'int', 'value': int(watermark)}
+
+
+def decode_watermark(encoded):
+    if encoded is None:
+        return None
+    if encoded['type'] == 'timestamp':
+        return pd.Timestamp(encoded['value'])
+    return int(encoded['value'])
+
+
+# Read the manifest of a snapshot (None if there is no snapshot)
+def read_manifest(path=SNAPSHOT_DIR):
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+# Write the cleaned frame as a Parquet dataset partitioned by year/country.
+# The snapshot is written next to the target and swapped in with a rename,
+# so readers never see a half-written directory.
+def write_snapshot(data, state, path=SNAPSHOT_DIR):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    frame = data.copy()
+    frame['year'] = pd.to_datetime(frame['stop_date']).dt.year.astype('Int16')
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = f"{os.path.abspath(path)}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    partitions = [col for col in PARTITION_COLUMNS if col in frame.columns]
+    pq.write_to_dataset(table, tmp_path, partition_cols=partitions)
+
+    manifest = {
+        'schema_version': SCHEMA_VERSION,
+        'created_at': time.time(),
+        'row_count': len(data),
+        'columns': {col: str(dtype) for col, dtype in data.dtypes.items()},
+        'partition_columns': partitions,
+        'sync_mode': state['sync_mode'],
+        'watermark': encode_watermark(state['watermark']),
+        'boundary_hashes': [int(h) for h in state['boundary_hashes']],
+        'age_median': state['age_median'],
+    }
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    old_path = f"{os.path.abspath(path)}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+
+# Load a snapshot (memory-mapped) and return the frame plus the sync state
+def read_snapshot(path=SNAPSHOT_DIR):
+    import pyarrow.parquet as pq
+
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No snapshot at {path}")
+    if manifest['schema_version'] != SCHEMA_VERSION:
+        raise ValueError(
+            f"Snapshot schema version {manifest['schema_version']} does not match {SCHEMA_VERSION}"
+        )
+    table = pq.read_table(path, memory_map=True, partitioning='hive')
+
+    # year only exists for partitioning; country_name comes back as a categorical
+    table = table.select([col for col in manifest['columns'] if col in table.column_names])
+    data = table.to_pandas()
+    state = {
+        'sync_mode': manifest['sync_mode'],
+        'watermark': decode_watermark(manifest['watermark']),
+        'boundary_hashes': set(manifest['boundary_hashes']),
+        'age_median': manifest['age_median'],
+    }
+    return data, state
+
+
+# Check a snapshot against its manifest; returns a list of problems
+def verify_snapshot(path=SNAPSHOT_DIR):
+    manifest = read_manifest(path)
+    if manifest is None:
+        return [f"No snapshot at {path}"]
+    try:
+        data, _ = read_snapshot(path)
+    except Exception as e:
+        return [f"Could not read snapshot: {e}"]
+    problems = []
+    if len(data) != manifest['row_count']:
+        problems.append(f"Row count {len(data)} does not match manifest ({manifest['row_count']})")
+    missing = set(manifest['columns']) - set(data.columns)
+    if missing:
+        problems.append(f"Missing columns: {', '.join(sorted(missing))}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or verify the traffic_stops Parquet snapshot")
+    parser.add_argument('command', choices=['build', 'verify'])
+    parser.add_argument('--path', default=SNAPSHOT_DIR, help="Snapshot directory")
+    parser.add_argument('--from-csv', help="build from this CSV of raw stops instead of PostgreSQL")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        from dataset import CHUNK_SIZE, TrafficStopsStore
+
+        started = time.perf_counter()
+        store = TrafficStopsStore()
+        if args.from_csv:
+            age_median = pd.read_csv(args.from_csv, usecols=['driver_age'])['driver_age'].median()
+            chunks = pd.read_csv(args.from_csv, chunksize=CHUNK_SIZE)
+            store.load_chunks(chunks, None if pd.isna(age_median) else float(age_median), source=args.from_csv)
+        else:
+            store.load()
+        manifest = write_snapshot(store.data, store.sync_state(), args.path)
+        print(f"Wrote {manifest['row_count']:,} rows to {args.path} in {time.perf_counter() - started:.1f}s")
+        return 0
+
+    problems = verify_snapshot(args.path)
+    if problems:
+        for problem in problems:
+            print(f"✗ {problem}")
+        return 1
+    manifest = read_manifest(args.path)
+    created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['created_at']))
+    print(f"✓ {manifest['row_count']:,} rows, schema v{manifest['schema_version']}, created {created}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
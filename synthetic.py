@@ -0,0 +1,176 @@
+# Synthetic traffic_stops data for benchmarks and local development.
+#
+#   python synthetic.py --rows 1000000 --url sqlite:///traffic_stops.db
+#   python synthetic.py --rows 10000000 --url postgresql+psycopg2://postgres@localhost/enforceiq
+#
+# Rows follow the traffic_stops schema with skewed, realistic value
+# distributions (most stops are speeding, few end in arrest, searches make
+# drug finds and arrests more likely, ...). Generation is chunked and seeded,
+# so the same --rows/--seed always produce the same table.
+
+import argparse
+import csv
+import io
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    BigInteger, Boolean, Column, Date, Integer, MetaData, Table, Text, Time, create_engine, text,
+)
+
+from dataset import CHUNK_SIZE, ID_COLUMN
+
+# Value -> share of stops
+COUNTRIES = {'Canada': 0.34, 'USA': 0.33, 'India': 0.33}
+GENDERS = {'M': 0.68, 'F': 0.32}
+RACES = {'White': 0.60, 'Black': 0.15, 'Hispanic': 0.12, 'Asian': 0.08, 'Other': 0.05}
+VIOLATIONS = {'Speeding': 0.45, 'Signal': 0.15, 'Seatbelt': 0.15, 'Other': 0.15, 'DUI': 0.10}
+OUTCOMES = {'Citation': 0.50, 'Warning': 0.32, 'Ticket': 0.18}  # before arrests are drawn
+DURATIONS = {'0-15 Min': 0.65, '16-30 Min': 0.25, '30+ Min': 0.10}
+SEARCH_TYPES = {'Vehicle Search': 0.6, 'Frisk': 0.4}
+# Share of stops in each hour of the day (busier in daytime)
+HOUR_WEIGHTS = np.array([2, 1, 1, 1, 1, 2, 3, 5, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 5, 4, 4, 3, 3, 2], dtype=float)
+
+SEARCH_RATE = 0.08
+DRUG_RATE = 0.01
+DRUG_RATE_SEARCHED = 0.25
+ARREST_RATE = 0.04
+ARREST_RATE_DUI = 0.35
+ARREST_RATE_DRUGS = 0.40
+MISSING_AGE_RATE = 0.02
+
+START_DATE = '2020-01-01'
+DAYS = 5 * 365
+
+TABLE = 'traffic_stops'
+
+
+def _choice(rng, weights, rows):
+    values = list(weights)
+    p = np.array([weights[v] for v in values], dtype=float)
+    return np.array(values, dtype=object)[rng.choice(len(values), rows, p=p / p.sum())]
+
+
+# Raw stops shaped like a pd.read_sql result from PostgreSQL (date/time
+# objects, None for missing values); ids start at first_id
+def synthetic_stops(rows, seed=0, first_id=1):
+    rng = np.random.default_rng(seed)
+    dates = pd.Series(np.datetime64(START_DATE) + rng.integers(0, DAYS, rows).astype('timedelta64[D]'))
+    hours = rng.choice(24, rows, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    seconds = hours * 3600 + rng.integers(0, 3600, rows)
+    times = (pd.Timestamp(0) + pd.to_timedelta(pd.Series(seconds), unit='s')).dt.time
+    ages = np.clip(rng.normal(38, 13, rows), 16, 90).astype(int).astype(object)
+    ages[rng.random(rows) < MISSING_AGE_RATE] = None
+
+    violation = _choice(rng, VIOLATIONS, rows)
+    searched = rng.random(rows) < SEARCH_RATE
+    drugs = rng.random(rows) < np.where(searched, DRUG_RATE_SEARCHED, DRUG_RATE)
+    arrest_rate = np.full(rows, ARREST_RATE)
+    arrest_rate[violation == 'DUI'] = ARREST_RATE_DUI
+    arrest_rate[drugs] = ARREST_RATE_DRUGS
+    arrested = rng.random(rows) < arrest_rate
+    outcome = _choice(rng, OUTCOMES, rows)
+    outcome[arrested] = 'Arrest'
+    search_type = _choice(rng, SEARCH_TYPES, rows)
+    search_type[~searched] = None
+
+    return pd.DataFrame({
+        ID_COLUMN: np.arange(first_id, first_id + rows, dtype='int64'),
+        'stop_date': dates.dt.date,
+        'stop_time': times,
+        'country_name': _choice(rng, COUNTRIES, rows),
+        'driver_gender': _choice(rng, GENDERS, rows),
+        'driver_age': ages,
+        'driver_race': _choice(rng, RACES, rows),
+        'violation': violation,
+        'search_conducted': searched,
+        'search_type': search_type,
+        'stop_outcome': outcome,
+        'is_arrested': arrested,
+        'stop_duration': _choice(rng, DURATIONS, rows),
+        'drugs_related_stop': drugs,
+        'vehicle_number': [f"VEH{n:06d}" for n in rng.integers(0, max(rows // 3, 1), rows)],
+    })
+
+
+# The same rows generated chunksize at a time (chunk i uses seed + i)
+def synthetic_chunks(rows, chunksize=CHUNK_SIZE, seed=0):
+    for i, start in enumerate(range(0, rows, chunksize)):
+        yield synthetic_stops(min(chunksize, rows - start), seed + i, first_id=start + 1)
+
+
+def traffic_stops_table(metadata):
+    return Table(
+        TABLE, metadata,
+        Column(ID_COLUMN, BigInteger, primary_key=True),
+        Column('stop_date', Date),
+        Column('stop_time', Time),
+        Column('country_name', Text),
+        Column('driver_gender', Text),
+        Column('driver_age', Integer),
+        Column('driver_race', Text),
+        Column('violation', Text),
+        Column('search_conducted', Boolean),
+        Column('search_type', Text),
+        Column('stop_outcome', Text),
+        Column('is_arrested', Boolean),
+        Column('stop_duration', Text),
+        Column('drugs_related_stop', Boolean),
+        Column('vehicle_number', Text),
+    )
+
+
+# pandas to_sql method that writes each batch with PostgreSQL COPY
+def _copy_rows(table, conn, keys, data_iter):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(data_iter)
+    buffer.seek(0)
+    columns = ', '.join(f'"{k}"' for k in keys)
+    with conn.connection.cursor() as cur:
+        cur.copy_expert(f"COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '')", buffer)
+
+
+# (Re)create traffic_stops on engine and fill it with rows synthetic stops.
+# Returns the seconds spent writing (generation excluded).
+def load_synthetic(engine, rows, chunksize=CHUNK_SIZE, seed=0, replace=True):
+    metadata = MetaData()
+    table = traffic_stops_table(metadata)
+    if replace:
+        table.drop(engine, checkfirst=True)
+    table.create(engine, checkfirst=True)
+    method = _copy_rows if engine.dialect.name == 'postgresql' else None
+    seconds = 0.0
+    for chunk in synthetic_chunks(rows, chunksize, seed):
+        started = time.perf_counter()
+        chunk.to_sql(TABLE, engine, if_exists='append', index=False, method=method, chunksize=chunksize)
+        seconds += time.perf_counter() - started
+    with engine.begin() as conn:
+        conn.execute(text(f"ANALYZE {TABLE}"))
+    return seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic traffic_stops data")
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help="SQLAlchemy URL of the database to load (traffic_stops is replaced)")
+    target.add_argument('--csv', help="write the rows to this CSV file instead")
+    args = parser.parse_args(argv)
+
+    if args.csv:
+        for i, chunk in enumerate(synthetic_chunks(args.rows, args.chunksize, args.seed)):
+            chunk.to_csv(args.csv, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+        print(f"{args.rows:,} stops written to {args.csv}")
+        return 0
+
+    seconds = load_synthetic(create_engine(args.url), args.rows, args.chunksize, args.seed)
+    print(f"{args.rows:,} stops loaded in {seconds:,.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# Concurrent execution for the dashboard.
+# Independent loads (the rollup behind Key Metrics, the chart figures, the
+# prediction index) are submitted to one process-wide thread pool as soon as
+# a script run starts, so they proceed in parallel with the Overview page and
+# each section waits only for its own result. Canned queries run as
+# cancellable tasks: when the script run waiting for one is interrupted (the
+# user picked another query mid-run), the statement is stopped on the
+# server (pg_cancel_backend) or in DuckDB (interrupt).
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import streamlit as st
+
+TASK_WORKERS = int(os.environ.get("ENFORCEIQ_TASK_WORKERS", "8"))
+# How often a waiting section refreshes its elapsed-time note (and notices
+# that the user interrupted the run)
+TASK_POLL_SECONDS = float(os.environ.get("ENFORCEIQ_TASK_POLL_SECONDS", "0.1"))
+
+THREAD_PREFIX = 'enforceiq-task'
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+# Cancellation flag for one task. The code running a statement attaches a
+# callable that interrupts it; cancel() sets the flag and calls it.
+class CancelToken:
+    def __init__(self):
+        self.cancelled = False
+        self._interrupt = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def attach(self, interrupt):
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelled()
+            self._interrupt = interrupt
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._interrupt = None
+
+    # Raise QueryCancelled if cancel() was called (used to tell a cancelled
+    # statement's error apart from a real failure)
+    def check(self):
+        if self.cancelled:
+            raise QueryCancelled()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            interrupt = self._interrupt
+        if interrupt is not None:
+            try:
+                interrupt()
+            except Exception as e:
+                print(f"Error cancelling query: {e}")
+
+
+class Task:
+    def __init__(self, future, token, name=None):
+        self.future = future
+        self.token = token
+        self.name = name
+        self.started = time.perf_counter()
+
+    def done(self):
+        return self.future.done()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def result(self):
+        return self.future.result()
+
+    # Drop the task if it has not started, otherwise interrupt its statement
+    def cancel(self):
+        self.future.cancel()
+        self.token.cancel()
+
+
+# Workers call cached loaders outside any script run; Streamlit warns about
+# the missing ScriptRunContext on every such call, which is expected here
+class _WorkerContextFilter(logging.Filter):
+    def filter(self, record):
+        return not record.threadName.startswith(THREAD_PREFIX)
+
+
+@st.cache_resource
+def get_executor():
+    logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').addFilter(_WorkerContextFilter())
+    return ThreadPoolExecutor(max_workers=TASK_WORKERS, thread_name_prefix=THREAD_PREFIX)
+
+
+# Run fn(*args, **kwargs) on the shared pool. Cancellable tasks receive their
+# CancelToken as the cancel keyword argument.
+def submit(fn, *args, name=None, cancellable=False, **kwargs):
+    token = CancelToken()
+    if cancellable:
+        kwargs['cancel'] = token
+    return Task(get_executor().submit(fn, *args, **kwargs), token, name)
+
+
+# Wait for task inside the script run, showing a running timer. A widget
+# change interrupts the run at the next Streamlit call; the task is then
+# cancelled before the interruption propagates.
+def wait(task, message=None):
+    status = st.empty()
+    try:
+        while not task.done():
+            status.caption(f"⏳ {message or task.name or 'Working'}... {task.elapsed():.1f}s")
+            time.sleep(TASK_POLL_SECONDS)
+    except BaseException:
+        task.cancel()
+        raise
+    status.empty()
+    return task.result()